@@ -0,0 +1,124 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+"""
+BENCHMARKS THE PROVIDER SYNCS AGAINST A LOCAL STUB SERVER
+
+Algolia, Cloudinary and Postgres are replaced by the in-memory sinks,
+so nothing leaves the machine. Each run happens in a fresh process to get
+its own peak RSS, e.g.
+
+    python3 background/benchmark.py --providers shopify --sizes 100,1000
+"""
+
+UPLOAD_SETTINGS = {
+    "includeTags": [],
+    "excludeTags": ["tag-13"],
+    "departmentMapping": [{"key": "shirts", "departments": ["Clothing"]}],
+}
+
+
+def run(
+    provider: str, size: int, templates: list[dict[str, Any]], latency: float
+) -> dict[str, Any]:
+    os.environ.setdefault("ETSY_API_KEY", "benchmark")
+
+    import lib.etsy
+    import lib.ratelimit
+    import lib.shopify
+    import lib.sinks
+    import lib.square
+    import lib.telemetry
+    from benchmarks import fakes
+    from benchmarks.fixtures import Catalog, serve
+
+    catalog = Catalog(size, templates)
+    server = serve(catalog)
+    host = lib.ratelimit.get_host(catalog.base_url)
+    lib.ratelimit.LIMITS[host] = (1e9, 10**9)
+    lib.ratelimit.LIMITS["api.cloudinary.com"] = (1e9, 10**9)
+    lib.etsy.API_URL = f"{catalog.base_url}/v2"
+
+    sinks = fakes.add_latency(lib.sinks.memory(), latency)
+
+    upload, homepage = {
+        "shopify": (lib.shopify.upload, catalog.base_url),
+        "etsy": (lib.etsy.upload, "https://www.etsy.com/shop/benchmark"),
+        "square": (lib.square.upload, f"{catalog.base_url}/"),
+    }[provider]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), lib.telemetry.trace(1) as trace:
+        upload(1, homepage, "43.65", "-79.38", "Benchmark", UPLOAD_SETTINGS, sinks)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    return {
+        "provider": provider,
+        "size": size,
+        "products": len(sinks.index.objects),
+        "seconds": elapsed,
+        "products_per_second": len(sinks.index.objects) / elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": trace.summary()["stages"],
+    }
+
+
+def report(result: dict[str, Any]):
+    print(
+        f"{result['provider']:>8} {result['size']:>7} products: "
+        f"{result['products_per_second']:>8.1f}/s, {result['seconds']:.2f}s, "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+    for stage, timing in result["stages"].items():
+        average = timing["seconds"] / max(timing["calls"], 1) * 1000
+        print(
+            f"{'':>17}{stage:<17} {timing['calls']:>7} calls, "
+            f"{timing['seconds']:>7.2f}s total, {average:.2f}ms average"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the provider syncs")
+    parser.add_argument("--providers", default="shopify,etsy,square")
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="milliseconds added to every sink call",
+    )
+    parser.add_argument(
+        "--recorded",
+        help="JSON file with raw products recorded from the provider, used in place of the synthetic ones",
+    )
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    templates = None
+    if args.recorded:
+        with open(args.recorded) as f:
+            templates = json.load(f)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for provider in args.providers.split(","):
+        for size in [int(x) for x in args.sizes.split(",")]:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(
+                    run, provider, size, templates, args.latency / 1000
+                ).result()
+            report(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
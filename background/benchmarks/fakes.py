@@ -0,0 +1,56 @@
+import contextlib
+import lib.sinks
+import time
+
+# Sink methods a sync calls, each one a network round-trip in production
+METHODS = {
+    "index": ["save_objects", "partial_update_objects", "delete_objects"],
+    "images": ["upload", "delete_prefix"],
+    "store": [
+        "get_products",
+        "get_sync_run",
+        "reserve_product_ids",
+        "get_images",
+        "save_images",
+        "clear_images",
+    ],
+}
+TRANSACTION_METHODS = [
+    "write_products",
+    "mark_seen",
+    "delete_products",
+    "save_sync_run",
+]
+
+
+def delayed(fn, latency: float):
+    """Wraps fn to sleep latency seconds per call, mimicking the network"""
+
+    def wrapper(*args, **kwargs):
+        time.sleep(latency)
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def add_latency(sinks: lib.sinks.Sinks, latency: float) -> lib.sinks.Sinks:
+    """Delays every call the sync makes to the sinks, transaction writes included"""
+    if latency <= 0:
+        return sinks
+
+    for sink, methods in METHODS.items():
+        target = getattr(sinks, sink)
+        for method in methods:
+            setattr(target, method, delayed(getattr(target, method), latency))
+
+    transaction = sinks.store.transaction
+
+    @contextlib.contextmanager
+    def delayed_transaction():
+        with transaction() as t:
+            for method in TRANSACTION_METHODS:
+                setattr(t, method, delayed(getattr(t, method), latency))
+            yield t
+
+    sinks.store.transaction = delayed_transaction
+    return sinks
@@ -0,0 +1,146 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+
+# Items per page of the Squarespace collection, Shopify and
+# Etsy pages are as large as the provider modules ask for
+SQUARE_PAGE_SIZE = 200
+
+
+class Catalog:
+    """
+    Synthetic catalog of size products, or one cycling through recorded
+    raw products of the provider when templates are given. Every product
+    gets its own id and image, as they would in a real shop.
+    """
+
+    def __init__(self, size: int, templates: Optional[list[dict[str, Any]]] = None):
+        self.size = size
+        self.templates = templates
+        self.base_url = ""
+
+    def template(self, i: int) -> Optional[dict[str, Any]]:
+        if not self.templates:
+            return None
+        return json.loads(json.dumps(self.templates[i % len(self.templates)]))
+
+    def image(self, i: int) -> str:
+        return f"{self.base_url}/images/{i}.jpg"
+
+    def shopify_product(self, i: int) -> dict[str, Any]:
+        product = self.template(i) or {
+            "title": f"Product {i} &amp; co",
+            "body_html": f"<p>Description of <b>product {i}</b></p>\n<ul><li>One</li><li>Two</li></ul>",
+            "product_type": "Shirts, Tops",
+            "tags": ["cotton", "summer", f"tag-{i % 50}"],
+            "variants": [
+                {"title": size, "price": f"{10 + i % 90}.99"}
+                for size in ["S", "M", "L", "XL"]
+            ],
+        }
+        product["id"] = i
+        product["handle"] = f"product-{i}"
+        product["images"] = [{"src": self.image(i)}]
+        return product
+
+    def etsy_listing(self, i: int) -> dict[str, Any]:
+        listing = self.template(i) or {
+            "title": f"Listing {i} &amp;quot;handmade&amp;quot;",
+            "description": f"Handmade listing {i}\nwith a long description",
+            "taxonomy_path": ["Home &amp; Living", "Decor"],
+            "price": f"{5 + i % 50}.00",
+            "tags": ["handmade", "gift", f"tag-{i % 50}"],
+            "Variations": [
+                {"options": [{"formatted_value": x} for x in ["Red", "Blue"]]}
+            ],
+        }
+        price = {"currency_code": "USD", "currency_formatted_raw": listing["price"]}
+        listing["listing_id"] = i
+        listing["url"] = f"https://www.etsy.com/listing/{i}"
+        listing["MainImage"] = {"url_570xN": self.image(i), "url_fullxfull": None}
+        listing["Inventory"] = [{"products": [{"offerings": [{"price": price}]}]}]
+        return listing
+
+    def square_item(self, i: int) -> dict[str, Any]:
+        item = self.template(i) or {
+            "title": f"Item {i}",
+            "excerpt": f"<p>Excerpt of item {i}</p>",
+            "categories": ["Candles"],
+            "tags": ["soy", f"tag-{i % 50}"],
+            "variants": [
+                {"price": 1500 + i % 1000, "attributes": {"Scent": x}}
+                for x in ["Pine", "Rose"]
+            ],
+        }
+        item["urlId"] = f"item-{i}"
+        item["items"] = [{"assetUrl": self.image(i)}]
+        return item
+
+    def page(self, offset: int, limit: int) -> range:
+        return range(offset, min(offset + limit, self.size))
+
+
+def make_handler(catalog: Catalog):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, body: Any):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("ETag", f'"{urlparse(self.path).path}"')
+            self.end_headers()
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            if url.path == "/collections/all/products.json":
+                limit = int(query.get("limit", "30"))
+                page = catalog.page((int(query["page"]) - 1) * limit, limit)
+                self.send_json({"products": [catalog.shopify_product(i) for i in page]})
+            elif url.path.startswith("/v2/shops/"):
+                limit = int(query.get("limit", "25"))
+                page = catalog.page((int(query["page"]) - 1) * limit, limit)
+                self.send_json({"results": [catalog.etsy_listing(i) for i in page]})
+            elif url.path.startswith("/v2/listings/"):
+                listing = catalog.etsy_listing(int(url.path.split("/")[3]))
+                self.send_json({"results": listing["Inventory"][0]})
+            elif url.path == "/" and query.get("format") == "json":
+                store_settings = {"continueShoppingLinkUrl": "shop"}
+                self.send_json({"websiteSettings": {"storeSettings": store_settings}})
+            elif url.path == "/shop":
+                offset = int(query.get("offset", "0"))
+                page = catalog.page(offset, SQUARE_PAGE_SIZE)
+                next_offset = offset + SQUARE_PAGE_SIZE
+                self.send_json(
+                    {
+                        "items": [catalog.square_item(i) for i in page],
+                        "pagination": {
+                            "nextPage": next_offset < catalog.size,
+                            "nextPageOffset": next_offset,
+                        },
+                    }
+                )
+            else:
+                self.send_response(404)
+                self.end_headers()
+
+    return Handler
+
+
+def serve(catalog: Catalog) -> ThreadingHTTPServer:
+    """Serves the catalog from a local port on a background thread"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(catalog))
+    catalog.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,116 +1,100 @@
-import html
-import json
-import lib.etsy
-import lib.shopify
-import lib.square
+import argparse
+import os
+import lib.images
+import lib.jobs
+import lib.reindex
+import lib.schedule
+import lib.schema
+import lib.sinks
 import lib.sumologic
-from lib.postgresql import get_connection
+import lib.upload
+from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
+from datetime import datetime
+from typing import Any
 
 sched = BlockingScheduler()
 
+# Minutes between looking for businesses due to sync
+TICK_MINUTES = int(os.environ.get("SCHEDULE_TICK_MINUTES", "5"))
 
-def upload():
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT id, name, next_product_id, homepages, latitude, longitude, upload_settings FROM businesses"
-            )
-            for record in cursor:
-                business_id = record["id"]
-                business_name = record["name"]
-                next_product_id = record["next_product_id"]
-                latitude = record["latitude"]
-                longitude = record["longitude"]
-                upload_settings = json.loads(html.unescape(record["upload_settings"]))
-                homepages = json.loads(html.unescape(record["homepages"]))
-
-                if "shopifyHomepage" in homepages and homepages["shopifyHomepage"]:
-                    if "shopify" in upload_settings:
-                        upload_settings = upload_settings["shopify"]
-                    else:
-                        upload_settings = {}
-                    if "includeTags" not in upload_settings:
-                        upload_settings["includeTags"] = []
-                    if "excludeTags" not in upload_settings:
-                        upload_settings["excludeTags"] = []
-                    if "departmentMapping" not in upload_settings:
-                        upload_settings["departmentMapping"] = []
-
-                    try:
-                        lib.shopify.upload(
-                            business_id,
-                            next_product_id,
-                            homepages["shopifyHomepage"],
-                            latitude,
-                            longitude,
-                            business_name,
-                            upload_settings,
-                        )
-                    except Exception as e:
-                        lib.sumologic.post(
-                            "error", str(e), "Shopify", {"name": business_name}
-                        )
-
-                elif "etsyHomepage" in homepages and homepages["etsyHomepage"]:
-                    if "etsy" in upload_settings:
-                        upload_settings = upload_settings["etsy"]
-                    else:
-                        upload_settings = {}
-                    if "includeTags" not in upload_settings:
-                        upload_settings["includeTags"] = []
-                    if "excludeTags" not in upload_settings:
-                        upload_settings["excludeTags"] = []
-                    if "departmentMapping" not in upload_settings:
-                        upload_settings["departmentMapping"] = []
-
-                    try:
-                        lib.etsy.upload(
-                            business_id,
-                            next_product_id,
-                            homepages["etsyHomepage"],
-                            latitude,
-                            longitude,
-                            business_name,
-                            upload_settings,
-                        )
-                    except Exception as e:
-                        lib.sumologic.post(
-                            "error", str(e), "Etsy", {"name": business_name}
-                        )
-
-                elif "squareHomepage" in homepages and homepages["squareHomepage"]:
-                    if "square" in upload_settings:
-                        upload_settings = upload_settings["square"]
-                    else:
-                        upload_settings = {}
-                    if "includeTags" not in upload_settings:
-                        upload_settings["includeTags"] = []
-                    if "excludeTags" not in upload_settings:
-                        upload_settings["excludeTags"] = []
-                    if "departmentMapping" not in upload_settings:
-                        upload_settings["departmentMapping"] = []
-
-                    try:
-                        lib.square.upload(
-                            business_id,
-                            next_product_id,
-                            homepages["squareHomepage"],
-                            latitude,
-                            longitude,
-                            business_name,
-                            upload_settings,
-                        )
-                    except Exception as e:
-                        lib.sumologic.post(
-                            "error", str(e), "Square", {"name": business_name}
-                        )
-
-
-@sched.scheduled_job("cron", day_of_week="mon", hour=20)
-def scheduled_job():
-    print("Starting upload process...")
-    upload()
-
-
-sched.start()
+
+def upload(sinks: lib.sinks.Sinks):
+    """Syncs every business once in this process, for dry runs"""
+
+    def sync(record: dict[str, Any]):
+        try:
+            lib.upload.sync_business(record, sinks)
+        except Exception as e:
+            print(f"Failed to sync {record['name']}: {e}")
+
+    records = lib.upload.get_businesses()
+    with ThreadPoolExecutor(int(os.environ.get("UPLOAD_WORKERS", "4"))) as executor:
+        list(executor.map(sync, records))
+
+
+@sched.scheduled_job("interval", minutes=TICK_MINUTES, next_run_time=datetime.now())
+def enqueue_due():
+    """Queues the syncs of the businesses that are due for the workers"""
+    lib.schedule.schedule_new()
+    business_ids = lib.schedule.claim_due(1000)
+    queued = lib.jobs.enqueue(business_ids)
+    if queued > 0:
+        print(f"Queued {queued} due syncs")
+
+    dead = lib.jobs.dead_letter_expired()
+    if dead > 0:
+        lib.sumologic.post("error", f"Gave up on {dead} syncs whose workers kept dying")
+
+
+@sched.scheduled_job("cron", hour=0)
+def prune_jobs():
+    lib.jobs.prune()
+
+
+@sched.scheduled_job("cron", day_of_week="sun", hour=20)
+def collect_images():
+    print("Deleting orphaned images...")
+    lib.images.collect_garbage()
+
+
+parser = argparse.ArgumentParser(description="Schedule the business syncs")
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    help="upload every business once into in-memory sinks instead of Algolia, Cloudinary and Postgres, then exit",
+)
+parser.add_argument(
+    "--sink-dir",
+    help="with --dry-run, keep the sinks as JSON files in this directory between runs",
+)
+parser.add_argument(
+    "--refresh",
+    type=int,
+    metavar="BUSINESS_ID",
+    help="make the business due now, the running clock queues it within minutes",
+)
+parser.add_argument(
+    "--reindex",
+    action="store_true",
+    help="rebuild the whole search index into a temporary one and swap it in, then exit",
+)
+args = parser.parse_args()
+
+if args.reindex:
+    lib.schema.migrate()
+    lib.reindex.rebuild()
+elif args.refresh is not None:
+    lib.schema.migrate()
+    lib.schedule.request_refresh(args.refresh)
+    print(f"Business {args.refresh} syncs on the next tick")
+elif args.dry_run:
+    # Businesses are still read from Postgres, nothing is written to it
+    sinks = lib.sinks.local(args.sink_dir) if args.sink_dir else lib.sinks.memory()
+    upload(sinks)
+    print(
+        f"Dry run finished with {len(sinks.index.objects)} records and {len(sinks.images.images)} images"
+    )
+else:
+    lib.schema.migrate()
+    sched.start()
@@ -1,10 +1,117 @@
+import lib.telemetry
 import os
+import time
 from algoliasearch.search_client import SearchClient, SearchIndex
+from lib.normalize import unescape
+from typing import Any, Callable, Iterator, Optional
 
 
-def get_index() -> SearchIndex:
-    client = SearchClient.create(
+def get_client() -> SearchClient:
+    return SearchClient.create(
         os.environ["ALGOLIASEARCH_APPLICATION_ID"], os.environ["ALGOLIASEARCH_API_KEY"]
     )
-    index = client.init_index(os.environ["ALGOLIASEARCH_INDEX"])
+
+
+def get_index() -> SearchIndex:
+    index = get_client().init_index(os.environ["ALGOLIASEARCH_INDEX"])
     return index
+
+
+def browse_business(
+    index: SearchIndex,
+    business_id: int,
+    business_name: str,
+    attributes: Optional[list[str]] = None,
+) -> Iterator[dict[str, Any]]:
+    """Yields the business's records, with only the given attributes if any"""
+    name = unescape(business_name).replace("\\", "\\\\").replace('"', '\\"')
+    params = {"query": "", "filters": f'business:"{name}"'}
+    if attributes is not None:
+        params["attributesToRetrieve"] = attributes
+    prefix = f"{business_id}_"
+    for record in index.browse_objects(params):
+        # Businesses may share their name
+        if record["objectID"].startswith(prefix):
+            yield record
+
+
+class BatchWriter:
+    """
+    Buffers records and saves them with save_objects, or partially updates
+    them with partial_update_objects, once batch_size records are queued or
+    flush_interval seconds have passed since the last flush. Closing flushes
+    the remainder and waits on the final batch only, Algolia applies an
+    index's tasks in order. before_flush is called ahead of each flush
+    that has records to send.
+    """
+
+    def __init__(
+        self,
+        index: SearchIndex,
+        batch_size: int = None,
+        flush_interval: float = None,
+        before_flush: Optional[Callable[[], None]] = None,
+    ):
+        self.index = index
+        self.batch_size = batch_size or int(
+            os.environ.get("ALGOLIASEARCH_BATCH_SIZE", "1000")
+        )
+        self.flush_interval = flush_interval or float(
+            os.environ.get("ALGOLIASEARCH_FLUSH_INTERVAL", "60")
+        )
+        self.before_flush = before_flush
+        self.records = []
+        self.updates = []
+        self.response = None
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Records still buffered when an error is raised are
+        # dropped, the failed work is redone when it's retried
+        if exc_type is None:
+            self.close()
+
+    def save(self, record: dict[str, Any]):
+        self.records.append(record)
+        self.maybe_flush()
+
+    def partial_update(self, record: dict[str, Any]):
+        """Queues an update of only the attributes in record, besides objectID"""
+        self.updates.append(record)
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if (
+            len(self.records) + len(self.updates) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.before_flush is not None and len(self.records) + len(self.updates) > 0:
+            self.before_flush()
+        for i in range(0, len(self.records), self.batch_size):
+            with lib.telemetry.span("index write"):
+                self.response = self.index.save_objects(
+                    self.records[i : i + self.batch_size],
+                    {"autoGenerateObjectIDIfNotExist": False},
+                )
+        for i in range(0, len(self.updates), self.batch_size):
+            with lib.telemetry.span("index write"):
+                self.response = self.index.partial_update_objects(
+                    self.updates[i : i + self.batch_size],
+                    {"createIfNotExists": False},
+                )
+        self.records = []
+        self.updates = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.response is not None:
+            with lib.telemetry.span("index wait"):
+                self.response.wait()
+            self.response = None
@@ -1,282 +1,162 @@
-import cloudinary.api
-import cloudinary.uploader
-import html
+import functools
 import json
-import random
-import requests
-import time
 import os
-import re
-from lib.postgresql import get_connection
-from lib.algoliasearch import get_index
-from typing import Any
+import lib.httpclient
+import lib.sync
+import lib.telemetry
+from lib.normalize import Normalizer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, Optional
 
+API_URL = os.environ.get("ETSY_API_URL", "https://openapi.etsy.com/v2")
 
-def upload(
-    business_id: int,
-    next_product_id: int,
-    homepage: str,
-    latitude: str,
-    longitude: str,
-    business_name: str,
-    upload_settings: dict[str, Any],
-):
-    print(f"Etsy upload from {homepage}")
-    print("Deleting old products...")
+# Listings fetched per page, 100 is the most Etsy allows
+PAGE_SIZE = 100
 
-    index = get_index()
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT id FROM products WHERE business_id=(%s)", (str(business_id),)
-            )
-            oldProductIds = [f"{business_id}_{x['id']}" for x in cursor.fetchall()]
+# Concurrent inventory requests for listings that came without one
+INVENTORY_WORKERS = 4
 
-            print("Removing from Algolia...")
-            index.delete_objects(oldProductIds)
 
-            print("Removing from Cloudinary...")
-            cloudinary.api.delete_resources_by_prefix(f"{business_id}/")
+def get_included_inventory(listing: dict[str, Any]) -> Optional[dict[str, Any]]:
+    inventory = listing.get("Inventory")
+    if isinstance(inventory, list):
+        inventory = inventory[0] if len(inventory) > 0 else None
+    return inventory
 
-            print("Removing from Postgres...")
-            cursor.execute(
-                "DELETE FROM products WHERE business_id=(%s)", (str(business_id),)
-            )
 
-    print("Retrieve new products...")
-    include_tags = [
-        html.unescape(x).lower().strip() for x in upload_settings["includeTags"]
-    ]
-    exclude_tags = [
-        html.unescape(x).lower().strip() for x in upload_settings["excludeTags"]
-    ]
+def get_inventory(listing_id: int) -> Optional[dict[str, Any]]:
+    with lib.telemetry.span("fetch inventory"):
+        r = lib.httpclient.get(
+            f"{API_URL}/listings/{listing_id}/inventory",
+            {"api_key": os.environ["ETSY_API_KEY"]},
+        )
+    if r.status_code != 200:
+        return None
+
+    data = json.loads(r.content)
+    return data["results"]
+
+
+def get_price(price: dict[str, Any]) -> float:
+    # Prices are converted to the shopper's currency, except for
+    # USD we want the price in the listing's original currency
+    if "before_conversion" in price:
+        original_currency_code = price["original_currency_code"]
+        if original_currency_code != "USD":
+            return float(price["before_conversion"]["currency_formatted_raw"])
+    return float(price["currency_formatted_raw"])
 
-    latitudes = [float(x.strip()) for x in latitude.split(",")]
-    longitudes = [float(x.strip()) for x in longitude.split(",")]
-    geolocation = [{"lat": x[0], "lng": x[1]} for x in zip(latitudes, longitudes)]
+
+def extract(listing: dict[str, Any], inventory: dict[str, Any]) -> dict[str, Any]:
+    variant_tags = [
+        y["formatted_value"] for x in listing["Variations"] for y in x["options"]
+    ]
+    offerings = [y for x in inventory["products"] for y in x["offerings"]]
+
+    return {
+        "departments": listing["taxonomy_path"],
+        "description": listing["description"],
+        "double_encoded": True,
+        "image": listing["MainImage"]["url_570xN"]
+        or listing["MainImage"]["url_fullxfull"],
+        "link": listing["url"],
+        "name": listing["title"],
+        "prices": [
+            float(listing["price"]),
+            *[get_price(x["price"]) for x in offerings],
+        ],
+        "product_types": [],
+        "source_id": str(listing["listing_id"]),
+        "tags": listing["tags"],
+        "variant_tags": variant_tags,
+    }
+
+
+def fetch_products(
+    homepage: str,
+    latitude: str,
+    longitude: str,
+    upload_settings: dict[str, Any],
+    cursor: Optional[int] = None,
+    since: Optional[float] = None,
+) -> Iterator[tuple[Optional[int], list[dict[str, Any]], Optional[list[str]]]]:
+    """
+    Given since, listings last modified before are left out and yielded as
+    unchanged instead
+    """
+    normalizer = Normalizer(upload_settings, latitude, longitude)
 
     homepageSections = homepage.split("/")
     shopId = homepageSections[-1]
 
-    page = 1
-    products = []
+    page = cursor or 1
     done = False
     while not done:
-        # Throttle requests to at most 20 per minute
-        time.sleep(random.uniform(3.0, 5.0))
-
-        r = requests.get(
-            f"https://openapi.etsy.com/v2/shops/{shopId}/listings/active",
-            {"api_key": os.environ["ETSY_API_KEY"], "page": page},
-        )
+        with lib.telemetry.span("fetch page"):
+            r = lib.httpclient.get(
+                f"{API_URL}/shops/{shopId}/listings/active",
+                {
+                    "api_key": os.environ["ETSY_API_KEY"],
+                    "includes": "MainImage,Variations,Inventory",
+                    "limit": PAGE_SIZE,
+                    "page": page,
+                },
+            )
         if r.status_code != 200:
-            print(f"Failed to retrieve page {page}")
-            done = True
-            continue
+            raise Exception(f"Failed to retrieve page {page}")
 
-        data_1 = json.loads(r.content)
-        raw_products = data_1["results"]
+        data = json.loads(r.content)
+        raw_products = data["results"]
         if len(raw_products) == 0:
             done = True
             continue
 
-        for product_listing in raw_products:
-            should_include = True
-            should_exclude = False
-            product_tags = list(
-                filter(
-                    None,
-                    [html.unescape(x).lower().strip() for x in product_listing["tags"]],
-                )
-            )
-            if len(include_tags) > 0:
-                should_include = (
-                    len([tag for tag in product_tags if tag in include_tags]) > 0
-                )
-            if len(exclude_tags) > 0:
-                should_exclude = (
-                    len([tag for tag in product_tags if tag in exclude_tags]) > 0
-                )
-            if should_exclude or not should_include:
-                continue
-
-            r = requests.get(
-                f"http://openapi.etsy.com/v2/listings/{product_listing['listing_id']}",
-                {
-                    "api_key": os.environ["ETSY_API_KEY"],
-                    "includes": "MainImage,Variations",
-                },
-            )
-            data_2 = json.loads(r.content)
-
-            product = data_2["results"][0]
-            product_name = html.unescape(product["title"].strip())
-            product_description = html.unescape(
-                html.unescape(
-                    re.sub(r"\s+", " ", re.sub(r"<[^>]*>", " ", product["description"]))
-                ).strip()
-            )
-            product_departments = list(
-                filter(
-                    None,
-                    map(lambda x: html.unescape(x.strip()), product["taxonomy_path"]),
-                )
-            )
-            product_link = product["url"].strip()
-            product_price = float(product["price"])
-            product_price_range = [product_price, product_price]
-            product_variant_tags = [
-                html.unescape(y["formatted_value"].strip())
-                for x in product["Variations"]
-                for y in x["options"]
+        # Filter on tags first, so no inventory is fetched for excluded listings
+        listings = [
+            x
+            for x in raw_products
+            if normalizer.is_included(normalizer.clean_tags(x["tags"]))
+        ]
+
+        # Unmodified listings need neither their inventory nor normalizing
+        unchanged = []
+        if since is not None:
+            unchanged = [
+                str(x["listing_id"]) for x in listings if x["last_modified_tsz"] < since
             ]
-            if len(product_variant_tags) == 0:
-                product_variant_tags = [""]
-            if product["MainImage"]["url_570xN"]:
-                product_variant_images = [product["MainImage"]["url_570xN"]] * len(
-                    product_variant_tags
-                )
-            else:
-                product_variant_images = [product["MainImage"]["url_fullxfull"]] * len(
-                    product_variant_tags
+            listings = [x for x in listings if x["last_modified_tsz"] >= since]
+
+        # Inventory normally comes included with the page, only the listings
+        # it is missing for are fetched one by one, in parallel
+        inventories = {x["listing_id"]: get_included_inventory(x) for x in listings}
+        missing_ids = [x for x, inventory in inventories.items() if inventory is None]
+        with ThreadPoolExecutor(INVENTORY_WORKERS) as executor:
+            for listing_id, inventory in zip(
+                missing_ids,
+                executor.map(lib.telemetry.propagate(get_inventory), missing_ids),
+            ):
+                inventories[listing_id] = inventory
+
+        items = []
+        for listing in listings:
+            inventory = inventories[listing["listing_id"]]
+            if inventory is None:
+                raise Exception(
+                    f"Failed to retrieve inventory of listing {listing['listing_id']}"
                 )
 
-            r = requests.get(
-                f"http://openapi.etsy.com/v2/listings/{product_listing['listing_id']}/inventory",
-                {"api_key": os.environ["ETSY_API_KEY"]},
-            )
-            if r.status_code != 200:
-                print(f"Failed to retrieve page {page}")
-                done = True
-                continue
-
-            data_3 = json.loads(r.content)
-
-            variant_prices = [
-                y["price"]
-                for x in data_3["results"]["products"]
-                for y in x["offerings"]
-            ]
-            for variant_price in variant_prices:
-                if "before_conversion" in variant_price:
-                    before_conversion = variant_price["before_conversion"]
-                    original_currency_code = variant_price["original_currency_code"]
-                else:
-                    before_conversion = {
-                        "currency_formatted_raw": variant_price[
-                            "currency_formatted_raw"
-                        ]
-                    }
-                    original_currency_code = variant_price["currency_code"]
-
-                currency_formatted_raw = variant_price["currency_formatted_raw"]
-                if original_currency_code == "USD":
-                    product_price_range[0] = min(
-                        product_price_range[0], float(currency_formatted_raw)
-                    )
-                    product_price_range[1] = max(
-                        product_price_range[1], float(currency_formatted_raw)
-                    )
-                else:
-                    currency_formatted_raw = before_conversion["currency_formatted_raw"]
-                    product_price_range[0] = min(
-                        product_price_range[0], float(currency_formatted_raw)
-                    )
-                    product_price_range[1] = max(
-                        product_price_range[1], float(currency_formatted_raw)
-                    )
+            items.append(extract(listing, inventory))
 
-            products.append(
-                {
-                    "departments": product_departments,
-                    "description": product_description,
-                    "id": str(next_product_id),
-                    "geolocation": geolocation,
-                    "link": product_link,
-                    "name": product_name,
-                    "price_range": product_price_range,
-                    "tags": product_tags,
-                    "variant_images": product_variant_images,
-                    "variant_tags": product_variant_tags,
-                }
-            )
-
-            next_product_id += 1
+        with lib.telemetry.span("normalize"):
+            products = normalizer.normalize(items)
         print(f"Successfully retrieved page {page}")
+        yield page + 1, products, unchanged
         page += 1
 
-    print("Done fetching new products!")
-    print("Uploading products...")
-
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            for product in products:
-                # Throttle requests to at most 20 per minute
-                time.sleep(random.uniform(3.0, 5.0))
-
-                variant_images = []
-                variant_map = {}
-                for i, variant_image in enumerate(product["variant_images"]):
-                    if variant_image in variant_map:
-                        variant_images.append(variant_map[variant_image])
-                        continue
-
-                    url_data = cloudinary.uploader.upload(
-                        variant_image,
-                        format="webp",
-                        public_id=f"{business_id}/{product['id']}/{i}",
-                        unique_filename=False,
-                        overwrite=True,
-                        exif=False,
-                    )
-
-                    variant_images.append(url_data["secure_url"])
-                    variant_map[variant_image] = url_data["secure_url"]
-
-                cursor.execute(
-                    "INSERT INTO products (business_id, id, name, preview) VALUES (%s, %s, %s, %s)",
-                    (
-                        str(business_id),
-                        product["id"],
-                        product["name"],
-                        variant_images[0],
-                    ),
-                )
-
-                index.save_object(
-                    {
-                        "objectID": f"{business_id}_{product['id']}",
-                        "_geoloc": geolocation,
-                        "name": product["name"],
-                        "business": html.unescape(business_name),
-                        "description": html.unescape(product["description"]),
-                        "description_length": len(
-                            html.unescape(product["description"]).replace(
-                                r"/\s+/gs", ""
-                            )
-                        ),
-                        "departments": product["departments"],
-                        "link": product["link"],
-                        "price_range": product["price_range"],
-                        "tags": product["tags"],
-                        "tags_length": len(
-                            html.unescape("".join(product["tags"])).replace(
-                                r"/s+/gs", ""
-                            )
-                        ),
-                        "variant_images": variant_images,
-                        "variant_tags": list(
-                            map(lambda x: html.unescape(x), product["variant_tags"])
-                        ),
-                    },
-                    {"autoGenerateObjectIDIfNotExist": False},
-                )
+        if len(raw_products) < PAGE_SIZE:
+            done = True
 
-                print(f"Successfully uploaded product: {product['name']}")
+    print("Done fetching new products!")
 
-            cursor.execute(
-                "UPDATE businesses SET next_product_id=(%s) WHERE id=(%s)",
-                (str(next_product_id), str(business_id)),
-            )
 
-    print(f"Finished uploading products from {homepage}")
+upload = functools.partial(lib.sync.upload_products, "Etsy", fetch_products)
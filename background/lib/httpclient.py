@@ -0,0 +1,104 @@
+import lib.ratelimit
+import lib.telemetry
+import os
+import random
+import requests
+import requests.adapters
+import threading
+import time
+
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "60"))
+
+# Connections kept alive per host, enough for every upload worker
+POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+
+# Attempts per request, and the base of the exponential
+# backoff between attempts that failed without a 429
+MAX_ATTEMPTS = int(os.environ.get("HTTP_MAX_ATTEMPTS", "5"))
+BACKOFF = float(os.environ.get("HTTP_BACKOFF", "1.0"))
+
+# Only idempotent requests are retried
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+
+_lock = threading.Lock()
+_sessions = {}
+_stats = {}
+
+
+def get_session(host: str) -> requests.Session:
+    with _lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=POOL_SIZE
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def record(host: str, seconds: float, size: int, failed: bool):
+    with _lock:
+        if host not in _stats:
+            _stats[host] = {"requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0}
+        stats = _stats[host]
+        stats["requests"] += 1
+        stats["errors"] += int(failed)
+        stats["bytes"] += size
+        stats["seconds"] += seconds
+
+
+def get_stats() -> dict[str, dict[str, float]]:
+    """
+    Returns the number of requests, failed requests, bytes received
+    and seconds spent waiting on responses for every host so far
+    """
+    with _lock:
+        return {host: dict(stats) for host, stats in _stats.items()}
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Sends the request over the host's pooled session once its rate limit
+    allows. Idempotent requests are retried with jittered exponential
+    backoff on connection errors and 5xx responses, and after the rate
+    limit's pause on 429 responses. The last response is returned once
+    the attempts run out, the last connection error is raised.
+    """
+    host = lib.ratelimit.get_host(url)
+    bucket = lib.ratelimit.get_bucket(url)
+    session = get_session(host)
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    attempts = MAX_ATTEMPTS if method in IDEMPOTENT_METHODS else 1
+
+    for attempt in range(attempts):
+        bucket.acquire()
+        start = time.monotonic()
+        try:
+            r = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            record(host, time.monotonic() - start, 0, True)
+            if attempt == attempts - 1:
+                raise
+        else:
+            record(host, time.monotonic() - start, len(r.content), r.status_code >= 400)
+            bucket.update(r)
+            if r.status_code == 429:
+                continue
+            if r.status_code < 500 or attempt == attempts - 1:
+                return r
+
+        with lib.telemetry.span("retry backoff"):
+            time.sleep(random.uniform(0, BACKOFF * 2**attempt))
+
+    return r
+
+
+def get(url: str, params: dict = None, **kwargs) -> requests.Response:
+    return request("GET", url, params=params, **kwargs)
+
+
+def head(url: str, **kwargs) -> requests.Response:
+    return request("HEAD", url, **kwargs)
@@ -0,0 +1,116 @@
+import cloudinary.api
+import hashlib
+import lib.httpclient
+import lib.sinks
+import lib.telemetry
+import os
+from lib.postgresql import get_connection
+
+# Cached images unused for this many days and no longer
+# referenced by any product are deleted from Cloudinary
+RETENTION_DAYS = int(os.environ.get("IMAGE_RETENTION_DAYS", "14"))
+
+
+def get_fingerprint(source_url: str) -> str:
+    # The ETag, or failing that the modification date and size, changes
+    # whenever the image is replaced without its URL changing
+    r = lib.httpclient.head(source_url, allow_redirects=True)
+    if r.status_code != 200:
+        return ""
+
+    etag = r.headers.get("ETag")
+    if etag:
+        return etag
+    return f"{r.headers.get('Last-Modified', '')}/{r.headers.get('Content-Length', '')}"
+
+
+class ImageCache:
+    """
+    Maps a business's source image URLs, along with their fingerprint,
+    to the copy uploaded to the image store for them. Loaded once per
+    sync, so images shared between products or unchanged between runs
+    are only uploaded once. Entries used by the sync are written back
+    by save().
+    """
+
+    def __init__(self, business_id: int, sinks: lib.sinks.Sinks):
+        self.business_id = business_id
+        self.sinks = sinks
+        self.entries = {}
+        self.keys_by_public_id = {}
+        self.fingerprints = {}
+        self.used = set()
+
+        with lib.telemetry.span("db read"):
+            records = sinks.store.get_images(business_id)
+        for record in records:
+            key = (record["source_url"], record["fingerprint"])
+            self.entries[key] = (record["public_id"], record["secure_url"])
+            self.keys_by_public_id[record["public_id"]] = key
+
+    def upload(self, source_url: str, known: list[str] = ()) -> tuple[str, str]:
+        """
+        Returns the public id and secure url of the stored copy of
+        source_url, uploading it first if there is none yet. A copy among
+        the known public ids is used as is, without checking source_url
+        for changes.
+        """
+        for public_id in known:
+            key = self.keys_by_public_id.get(public_id)
+            if key is not None and key[0] == source_url:
+                self.used.add(key)
+                return self.entries[key]
+
+        if source_url not in self.fingerprints:
+            with lib.telemetry.span("image fingerprint"):
+                self.fingerprints[source_url] = get_fingerprint(source_url)
+        key = (source_url, self.fingerprints[source_url])
+
+        if key not in self.entries:
+            digest = hashlib.sha1("\n".join(key).encode("utf-8")).hexdigest()
+            with lib.telemetry.span("image upload"):
+                url_data = self.sinks.images.upload(
+                    source_url, f"{self.business_id}/images/{digest}"
+                )
+            self.entries[key] = (url_data["public_id"], url_data["secure_url"])
+            self.keys_by_public_id[url_data["public_id"]] = key
+
+        self.used.add(key)
+        return self.entries[key]
+
+    def save(self):
+        rows = [(int(self.business_id), *key, *self.entries[key]) for key in self.used]
+        with lib.telemetry.span("db write"):
+            self.sinks.store.save_images(rows)
+        self.used = set()
+
+
+def collect_garbage():
+    """
+    Deletes cached images that no product references anymore and
+    that haven't been used by a sync for RETENTION_DAYS days
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT business_id, public_id FROM image_cache
+                WHERE last_used_at < NOW() - make_interval(days => %s)
+                AND NOT EXISTS (
+                    SELECT 1 FROM products
+                    WHERE products.business_id=image_cache.business_id
+                    AND image_cache.public_id=ANY(products.images)
+                )
+                """,
+                (RETENTION_DAYS,),
+            )
+            orphans = cursor.fetchall()
+
+            print(f"Deleting {len(orphans)} orphaned images...")
+            for i in range(0, len(orphans), 100):
+                public_ids = [x["public_id"] for x in orphans[i : i + 100]]
+                cloudinary.api.delete_resources(public_ids)
+                cursor.execute(
+                    "DELETE FROM image_cache WHERE public_id IN %s",
+                    (tuple(public_ids),),
+                )
@@ -0,0 +1,251 @@
+import contextlib
+import os
+import threading
+from lib.postgresql import get_connection
+from typing import Any, Callable, ContextManager, Iterator, Optional
+
+"""
+QUEUE OF BUSINESS SYNCS
+
+The clock enqueues one job per business due to sync, and any number of
+worker processes claim them with FOR UPDATE SKIP LOCKED. A claimed job is
+leased to its worker, which renews the lease while the sync runs. Jobs whose
+lease runs out, because their worker died, are claimed again and resume from
+the sync's last checkpoint. Failed jobs are retried with exponential backoff
+and dead-lettered after MAX_ATTEMPTS attempts.
+"""
+
+LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+RETRY_BACKOFF_SECONDS = int(os.environ.get("JOB_RETRY_BACKOFF_SECONDS", "600"))
+
+# Days finished and dead-lettered jobs are kept for
+RETENTION_DAYS = int(os.environ.get("JOB_RETENTION_DAYS", "30"))
+
+
+def enqueue(business_ids: list[int]) -> int:
+    """
+    Queues a sync of each business, unless one is already queued or
+    running. Returns the number of jobs queued.
+    """
+    if len(business_ids) == 0:
+        return 0
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO sync_jobs (business_id)
+                SELECT UNNEST(%s::INTEGER[])
+                ON CONFLICT (business_id) WHERE status IN ('queued', 'running') DO NOTHING
+                """,
+                (business_ids,),
+            )
+            return cursor.rowcount
+
+
+def claim(worker: str) -> Optional[dict[str, Any]]:
+    """
+    Leases the next job that is due, or whose lease ran out, to the
+    worker. Returns the job, or None if there is nothing to do.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE sync_jobs SET status='running', attempts=attempts+1, worker=%s,
+                lease_until=NOW() + make_interval(secs => %s), updated_at=NOW()
+                WHERE id=(
+                    SELECT id FROM sync_jobs
+                    WHERE (status='queued' AND run_after <= NOW())
+                    OR (status='running' AND lease_until < NOW() AND attempts < %s)
+                    ORDER BY run_after LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, business_id, attempts
+                """,
+                (worker, LEASE_SECONDS, MAX_ATTEMPTS),
+            )
+            return cursor.fetchone()
+
+
+# Jobs are only renewed and finished by the worker still running them.
+# A job whose lease ran out may have been claimed again, by another worker
+# or another thread of the same one, which counts as a new attempt.
+OWNED = "id=%s AND worker=%s AND attempts=%s AND status='running'"
+
+
+def renew(job: dict[str, Any], worker: str) -> bool:
+    """Extends the job's lease, returns False if the worker lost it"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE sync_jobs SET lease_until=NOW() + make_interval(secs => %s), updated_at=NOW()
+                WHERE {OWNED}
+                """,
+                (LEASE_SECONDS, job["id"], worker, job["attempts"]),
+            )
+            return cursor.rowcount == 1
+
+
+def renew_all(worker: str) -> bool:
+    """Extends the leases of every job the worker runs"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE sync_jobs SET lease_until=NOW() + make_interval(secs => %s), updated_at=NOW()
+                WHERE worker=%s AND status='running'
+                """,
+                (LEASE_SECONDS, worker),
+            )
+            return True
+
+
+@contextlib.contextmanager
+def heartbeat(renew: Callable[[], bool], name: str) -> Iterator[None]:
+    """Calls renew in the background while the code inside runs"""
+    done = threading.Event()
+
+    def run():
+        while not done.wait(LEASE_SECONDS / 3):
+            try:
+                if not renew():
+                    print(f"Lost the lease of {name}")
+                    return
+            except Exception as e:
+                print(f"Failed to renew the lease of {name}: {e}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def lease(job: dict[str, Any], worker: str) -> ContextManager[None]:
+    """Renews the job's lease in the background while the code inside runs"""
+    return heartbeat(lambda: renew(job, worker), f"job {job['id']}")
+
+
+def hold(business_id: int, worker: str) -> Optional[dict[str, Any]]:
+    """
+    Leases a job for the business to the worker right away, taking over
+    the queued one if there is one, which the job's queued says. Returns
+    None while another worker runs one.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE sync_jobs SET status='running', attempts=attempts+1, worker=%s,
+                lease_until=NOW() + make_interval(secs => %s), updated_at=NOW()
+                WHERE business_id=%s AND status='queued'
+                RETURNING id, business_id, attempts, TRUE AS queued
+                """,
+                (worker, LEASE_SECONDS, business_id),
+            )
+            job = cursor.fetchone()
+            if job is None:
+                cursor.execute(
+                    """
+                    INSERT INTO sync_jobs (business_id, status, attempts, worker, lease_until)
+                    VALUES (%s, 'running', 1, %s, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (business_id) WHERE status IN ('queued', 'running') DO NOTHING
+                    RETURNING id, business_id, attempts, FALSE AS queued
+                    """,
+                    (business_id, worker, LEASE_SECONDS),
+                )
+                job = cursor.fetchone()
+            return job
+
+
+def complete(job: dict[str, Any], worker: str) -> bool:
+    """Marks the job done, returns False if the worker lost it"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE sync_jobs SET status='done', lease_until=NULL, updated_at=NOW() WHERE {OWNED}",
+                (job["id"], worker, job["attempts"]),
+            )
+            return cursor.rowcount == 1
+
+
+def release(job: dict[str, Any], worker: str) -> bool:
+    """
+    Hands back a job from hold, queueing the one it took over to run right
+    away without counting the attempt, and marking the others done.
+    Returns False if the worker lost it.
+    """
+    if not job["queued"]:
+        return complete(job, worker)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE sync_jobs SET status='queued', attempts=attempts-1, lease_until=NULL,
+                run_after=NOW(), updated_at=NOW()
+                WHERE {OWNED}
+                """,
+                (job["id"], worker, job["attempts"]),
+            )
+            return cursor.rowcount == 1
+
+
+def fail(job: dict[str, Any], worker: str, error: str) -> bool:
+    """
+    Queues the job again after a backoff, or dead-letters it once it
+    used up its attempts. Returns True if it was dead-lettered, jobs
+    the worker lost are left to their new owner.
+    """
+    dead = job["attempts"] >= MAX_ATTEMPTS
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE sync_jobs SET status=%s, last_error=%s, lease_until=NULL,
+                run_after=NOW() + make_interval(secs => %s), updated_at=NOW()
+                WHERE {OWNED}
+                """,
+                (
+                    "dead" if dead else "queued",
+                    error,
+                    RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1),
+                    job["id"],
+                    worker,
+                    job["attempts"],
+                ),
+            )
+            return dead and cursor.rowcount == 1
+
+
+def dead_letter_expired() -> int:
+    """
+    Dead-letters the jobs whose lease ran out on their last attempt,
+    their workers kept dying. Returns the number of jobs dead-lettered.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE sync_jobs SET status='dead', last_error='Lease expired', lease_until=NULL, updated_at=NOW()
+                WHERE status='running' AND lease_until < NOW() AND attempts >= %s
+                """,
+                (MAX_ATTEMPTS,),
+            )
+            return cursor.rowcount
+
+
+def prune():
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM sync_jobs WHERE status IN ('done', 'dead')
+                AND updated_at < NOW() - make_interval(days => %s)
+                """,
+                (RETENTION_DAYS,),
+            )
@@ -0,0 +1,121 @@
+import functools
+import html
+import re
+from typing import Any, Optional
+
+HTML_TAG = re.compile(r"<[^>]*>")
+WHITESPACE = re.compile(r"\s+")
+DUPLICATE_SLASHES = re.compile(r"(?<!:)//+")
+
+
+@functools.lru_cache(maxsize=65536)
+def unescape(text: str) -> str:
+    # Tags, product types and variant names repeat across most of a
+    # catalog, so each distinct string is only unescaped once. Names and
+    # descriptions hardly ever repeat and go to html.unescape directly,
+    # rather than filling the cache with them.
+    return html.unescape(text)
+
+
+def clean_key(text: str) -> str:
+    return unescape(text).lower().strip()
+
+
+def strip_html(text: str, double_encoded: bool = False) -> str:
+    text = html.unescape(WHITESPACE.sub(" ", HTML_TAG.sub(" ", text or "")))
+    if double_encoded:
+        text = html.unescape(text)
+    return text.strip()
+
+
+def join_url(*parts: str) -> str:
+    return DUPLICATE_SLASHES.sub("/", "/".join(parts))
+
+
+def count_visible(text: str) -> int:
+    return len(WHITESPACE.sub("", text))
+
+
+class Normalizer:
+    """
+    Turns the items a provider extracted from its raw listings into the
+    products the sync uploads. Built once per business from its upload
+    settings and location, then applied to each page of items.
+
+    Extracted items have a source_id, name, description (HTML), link,
+    image, the prices and variant_tags of their variants, their raw tags
+    and product types, and optionally departments of their own in place
+    of the business's department mapping. Items whose listing has no tags
+    at all have None for tags, and aren't filtered by them.
+    """
+
+    def __init__(self, upload_settings: dict[str, Any], latitude: str, longitude: str):
+        self.include_tags = {clean_key(x) for x in upload_settings["includeTags"]}
+        self.exclude_tags = {clean_key(x) for x in upload_settings["excludeTags"]}
+        self.department_mappings = {
+            clean_key(x["key"]): [clean_key(y) for y in x["departments"]]
+            for x in upload_settings["departmentMapping"]
+        }
+
+        latitudes = [float(x.strip()) for x in latitude.split(",")]
+        longitudes = [float(x.strip()) for x in longitude.split(",")]
+        self.geolocation = [
+            {"lat": x[0], "lng": x[1]} for x in zip(latitudes, longitudes)
+        ]
+
+    def clean_tags(self, tags: list[str]) -> list[str]:
+        return [x for x in map(clean_key, tags) if x]
+
+    def is_included(self, tags: Optional[list[str]]) -> bool:
+        """
+        Tells whether products with these cleaned tags pass the tag
+        filters, products without any tags (None) always do
+        """
+        if tags is None:
+            return True
+        if len(self.include_tags) > 0 and self.include_tags.isdisjoint(tags):
+            return False
+        return self.exclude_tags.isdisjoint(tags)
+
+    def normalize_item(self, item: dict[str, Any]) -> Optional[dict[str, Any]]:
+        tags = None if item["tags"] is None else self.clean_tags(item["tags"])
+        if not self.is_included(tags) or len(item["prices"]) == 0:
+            return None
+
+        product_types = self.clean_tags(item["product_types"])
+        if item.get("departments") is not None:
+            departments = [
+                unescape(x.strip()) for x in item["departments"] if x.strip()
+            ]
+        else:
+            departments = [
+                department
+                for product_type in product_types
+                for department in self.department_mappings.get(product_type, [])
+            ]
+
+        variant_tags = [unescape(x).strip() for x in item["variant_tags"]]
+        if len(variant_tags) == 0:
+            variant_tags = [""]
+
+        return {
+            "departments": departments,
+            "description": strip_html(
+                item["description"], item.get("double_encoded", False)
+            ),
+            "geolocation": self.geolocation,
+            "link": item["link"].strip(),
+            "name": html.unescape(item["name"].strip()),
+            "price_range": [min(item["prices"]), max(item["prices"])],
+            "source_id": item["source_id"],
+            "tags": [*product_types, *(tags or [])],
+            "variant_images": [item["image"]] * len(variant_tags),
+            "variant_tags": variant_tags,
+        }
+
+    def normalize(self, items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        Normalizes a page of extracted items, leaving out the
+        ones filtered out by tag or that have no variants
+        """
+        return [x for x in map(self.normalize_item, items) if x is not None]
@@ -0,0 +1,56 @@
+import lib.telemetry
+import os
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# How many fetched batches may wait for the uploader before
+# the fetching thread blocks, bounding memory use per sync
+DEPTH = int(os.environ.get("PIPELINE_DEPTH", "4"))
+
+_DONE = object()
+
+
+def prefetch(batches: Iterable[T], depth: int = DEPTH) -> Iterator[T]:
+    """
+    Iterates batches on a background thread, staying at most depth batches
+    ahead of the consumer. Exceptions raised while fetching are re-raised
+    to the consumer, and stopping early stops the fetching thread too.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if not put(batch):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=lib.telemetry.propagate(produce), daemon=True)
+    thread.start()
+    try:
+        while True:
+            # Time the consumer spends waiting for the next batch
+            with lib.telemetry.span("fetch wait"):
+                item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
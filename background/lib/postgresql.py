@@ -1,12 +1,144 @@
+import contextlib
 import os
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+import threading
+import time
+from typing import Iterator
+
+"""
+SHARED POOL OF POSTGRES CONNECTIONS
+
+Every thread of a process checks connections out of the same pool, which
+opens them as they're needed, up to MAX_CONNECTIONS at once. Once
+they're all checked out, threads wait their turn for up to CHECKOUT_TIMEOUT
+seconds. Connections that sat idle for a while are tested before being
+handed out, and the ones that broke are replaced.
+"""
+
+# Connections kept open between checkouts, and the most open at once.
+# Connections above the minimum are closed when they're returned. Each
+# thread holds one at a time, so the maximum should cover its threads.
+MIN_CONNECTIONS = int(os.environ.get("POSTGRES_MIN_CONNECTIONS", "4"))
+MAX_CONNECTIONS = int(os.environ.get("POSTGRES_MAX_CONNECTIONS", "10"))
+
+# Seconds to wait for a connection once they're all checked out
+CHECKOUT_TIMEOUT = float(os.environ.get("POSTGRES_CHECKOUT_TIMEOUT", "60"))
+
+# Seconds a connection may sit idle before it's tested on checkout
+HEALTH_CHECK_SECONDS = float(os.environ.get("POSTGRES_HEALTH_CHECK_SECONDS", "30"))
+
+# Milliseconds any statement may run before Postgres cancels it, 0 for no limit
+STATEMENT_TIMEOUT_MS = int(os.environ.get("POSTGRES_STATEMENT_TIMEOUT_MS", "300000"))
+
+
+class Connection(psycopg2.extras.RealDictConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_used = time.monotonic()
+
+
+_lock = threading.Lock()
+_pool = None
+_pid = None
+_slots = None
+_stats = {
+    "checkouts": 0,
+    "timeouts": 0,
+    "wait_seconds": 0.0,
+    "max_wait_seconds": 0.0,
+    "replaced": 0,
+}
+
+
+def get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    """Returns the process's pool, a forked process gets its own"""
+    global _pool, _pid, _slots
+    with _lock:
+        if _pool is None or _pid != os.getpid():
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                MIN_CONNECTIONS,
+                MAX_CONNECTIONS,
+                os.environ["DATABASE_URL"],
+                connection_factory=Connection,
+                options=f"-c statement_timeout={STATEMENT_TIMEOUT_MS}",
+            )
+            _pid = os.getpid()
+            _slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        return _pool
+
+
+def is_healthy(conn: Connection) -> bool:
+    if conn.closed:
+        return False
+    if time.monotonic() - conn.last_used < HEALTH_CHECK_SECONDS:
+        return True
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def checkout(pool: psycopg2.pool.ThreadedConnectionPool) -> Connection:
+    while True:
+        conn = pool.getconn()
+        if is_healthy(conn):
+            return conn
+        pool.putconn(conn, close=True)
+        with _lock:
+            _stats["replaced"] += 1
+
 
 # Get connection to PSQL database
-def get_connection():
-    conn = psycopg2.connect(
-        os.environ["DATABASE_URL"],
-        connection_factory=psycopg2.extras.RealDictConnection,
-    )
-    conn.autocommit = True
-    return conn
+@contextlib.contextmanager
+def get_connection(autocommit: bool = True) -> Iterator[Connection]:
+    """
+    Checks a connection out of the pool for the code inside. Without
+    autocommit, its transaction is committed on exit, or rolled back on
+    error.
+    """
+    pool = get_pool()
+    slots = _slots
+    start = time.monotonic()
+    acquired = slots.acquire(timeout=CHECKOUT_TIMEOUT)
+    wait = time.monotonic() - start
+    with _lock:
+        _stats["checkouts"] += int(acquired)
+        _stats["timeouts"] += int(not acquired)
+        _stats["wait_seconds"] += wait
+        _stats["max_wait_seconds"] = max(_stats["max_wait_seconds"], wait)
+    if not acquired:
+        raise psycopg2.pool.PoolError(
+            f"No Postgres connection freed up within {CHECKOUT_TIMEOUT} seconds"
+        )
+
+    try:
+        conn = checkout(pool)
+        try:
+            conn.autocommit = autocommit
+            with conn:
+                yield conn
+        finally:
+            # Connections left in any state but idle, such as the ones
+            # that broke or failed to roll back, are closed
+            idle = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            broken = conn.closed or conn.info.transaction_status != idle
+            conn.last_used = time.monotonic()
+            pool.putconn(conn, close=broken)
+    finally:
+        slots.release()
+
+
+def get_stats() -> dict[str, float]:
+    """
+    Returns the number of checkouts, checkouts that timed out, seconds
+    spent waiting for connections in total and at most, and connections
+    replaced for failing their health check so far
+    """
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,118 @@
+import email.utils
+import lib.telemetry
+import requests
+import threading
+import time
+from urllib.parse import urlparse
+
+# Requests per second and burst size of known upstream hosts,
+# every other host falls back to DEFAULT_LIMIT
+LIMITS = {
+    "openapi.etsy.com": (5.0, 10),
+    "api.cloudinary.com": (5.0, 5),
+    "cdn.shopify.com": (10.0, 10),
+    "i.etsystatic.com": (10.0, 10),
+    "images.squarespace-cdn.com": (10.0, 10),
+}
+DEFAULT_LIMIT = (2.0, 2)
+
+# How long to back off after a 429 that has no Retry-After header
+DEFAULT_RETRY_AFTER = 10.0
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every thread talking to one host. The rate
+    is halved whenever the host answers 429 and creeps back up to the
+    configured rate with every successful response.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            with lib.telemetry.span("throttle"):
+                time.sleep(delay)
+
+    def update(self, response: requests.Response):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if response.status_code == 429:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = DEFAULT_RETRY_AFTER
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                self.tokens = 0.0
+                self.rate = max(self.rate / 2, self.max_rate / 16)
+                return
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+            # Shopify reports how full its own leaky bucket is as "used/limit",
+            # never hold more tokens than the calls it has left
+            call_limit = response.headers.get("X-Shopify-Shop-Api-Call-Limit")
+            if call_limit:
+                try:
+                    used, limit = [int(x) for x in call_limit.split("/")]
+                    self.tokens = min(self.tokens, float(max(limit - used - 1, 0)))
+                except ValueError:
+                    pass
+
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+
+
+_lock = threading.Lock()
+_buckets = {}
+
+
+def parse_retry_after(value: str) -> float:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0.0)
+
+
+def get_host(url: str) -> str:
+    return urlparse(url).netloc or url
+
+
+def get_bucket(url: str) -> TokenBucket:
+    host = get_host(url)
+    with _lock:
+        if host not in _buckets:
+            rate, capacity = LIMITS.get(host, DEFAULT_LIMIT)
+            _buckets[host] = TokenBucket(rate, capacity)
+        return _buckets[host]
+
+
+def acquire(url: str):
+    get_bucket(url).acquire()
@@ -0,0 +1,120 @@
+import lib.algoliasearch
+import lib.jobs
+import lib.sinks
+import lib.upload
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+"""
+REBUILDS THE SEARCH INDEX FROM SCRATCH
+
+Every business is synced into a temporary index carrying the live index's
+settings, synonyms and rules, which then replaces the live index in a single
+move, so searchers never see a business halfway through its sync. While the
+rebuild runs it holds the sync job of every business it got to, so that no
+worker writes to the live index only for the move to undo it. Businesses
+that have no homepage to sync from, or whose sync failed, keep the records
+they have in the live index, which are copied over as they are once every
+other business is synced, right before the move. Changes the dashboard
+makes to their products while they are copied are still lost from search,
+though not from Postgres, so that window is only as long as the copying.
+
+Products are stored as a rebuild finds them, but with the fingerprints they
+had, so the next sync of each business redoes the rebuild's changes in the
+live index, whether or not the move happened. Products the rebuild found
+gone are deleted by that sync too.
+"""
+
+# Businesses rebuilt at once
+WORKERS = int(os.environ.get("REINDEX_WORKERS", "8"))
+
+# Seconds between tries to get at the businesses a worker is syncing
+RETRY_SECONDS = float(os.environ.get("REINDEX_RETRY_SECONDS", "60"))
+
+
+def copy_records(source, destination, record: dict[str, Any]) -> int:
+    """Copies the business's records between the indices, returns how many"""
+    count = 0
+    with lib.algoliasearch.BatchWriter(destination) as writer:
+        for x in lib.algoliasearch.browse_business(
+            source, record["id"], record["name"]
+        ):
+            writer.save(x)
+            count += 1
+    return count
+
+
+def rebuild():
+    client = lib.algoliasearch.get_client()
+    live_name = os.environ["ALGOLIASEARCH_INDEX"]
+    temp_name = f"{live_name}_rebuild"
+    worker = f"rebuild:{os.environ.get('DYNO', socket.gethostname())}:{os.getpid()}"
+
+    # Possibly left behind by a rebuild that didn't finish
+    client.init_index(temp_name).delete().wait()
+    client.copy_index(
+        live_name, temp_name, {"scope": ["settings", "synonyms", "rules"]}
+    ).wait()
+    live_index = client.init_index(live_name)
+    temp_index = client.init_index(temp_name)
+    sinks = lib.sinks.production(temp_index)
+
+    jobs = []
+    failed = []
+    kept = []
+    lock = threading.Lock()
+
+    def sync(record: dict[str, Any]) -> bool:
+        job = lib.jobs.hold(record["id"], worker)
+        if job is None:
+            return False
+        with lock:
+            jobs.append(job)
+        try:
+            stats = lib.upload.sync_business(record, sinks, rebuild=True)
+        except Exception as e:
+            print(f"Failed to rebuild {record['name']}, keeping its records: {e}")
+            with lock:
+                failed.append(record["name"])
+            stats = None
+        if stats is None:
+            with lock:
+                kept.append(record)
+        return True
+
+    def copy(record: dict[str, Any]):
+        count = copy_records(live_index, temp_index, record)
+        print(f"Copied {count} records of {record['name']}")
+
+    # Should the rebuild fail, the held jobs are picked up by the workers
+    # once their leases run out, and the live index keeps its records
+    with lib.jobs.heartbeat(lambda: lib.jobs.renew_all(worker), worker):
+        pending = lib.upload.get_businesses()
+        print(f"Rebuilding {len(pending)} businesses into {temp_name}...")
+        while True:
+            with ThreadPoolExecutor(WORKERS) as executor:
+                done = list(executor.map(sync, pending))
+            pending = [x for x, synced in zip(pending, done) if not synced]
+            if len(pending) == 0:
+                break
+            print(f"Waiting for {len(pending)} businesses to finish syncing...")
+            time.sleep(RETRY_SECONDS)
+
+        print(f"Copying the records of {len(kept)} businesses...")
+        with ThreadPoolExecutor(WORKERS) as executor:
+            list(executor.map(copy, kept))
+
+        print(f"Moving {temp_name} to {live_name}...")
+        client.move_index(temp_name, live_name).wait()
+
+    for job in jobs:
+        lib.jobs.complete(job, worker)
+    if len(failed) > 0:
+        print(f"Kept the records of {len(failed)} businesses that failed to rebuild:")
+        for name in failed:
+            print(f"  {name}")
+    print("Rebuilt the search index")
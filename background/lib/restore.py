@@ -0,0 +1,198 @@
+import csv
+import io
+import lib.algoliasearch
+import lib.jobs
+import lib.upload
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from lib.postgresql import get_connection
+from typing import Any, Iterable, Iterator, Optional
+
+"""
+RESTORES LOST PRODUCT ROWS FROM THE SEARCH INDEX
+
+Each business's records are browsed with a filter on its name and copied
+into a temporary table, from which the products missing from Postgres are
+inserted in a single statement. Products still in Postgres are left as they
+are, they are skipped when they match their record and counted as
+conflicting when they don't. Restored products have no source_id, so the
+next sync of their business replaces them like any product it can't match.
+The sync jobs of the businesses are held while they are restored, so that
+no worker syncs them at the same time.
+"""
+
+# Businesses restored at once
+WORKERS = int(os.environ.get("RESTORE_WORKERS", "4"))
+
+# Records sent to Postgres per COPY
+BATCH_SIZE = int(os.environ.get("RESTORE_BATCH_SIZE", "10000"))
+
+
+def to_array(values: list[str]) -> str:
+    """Formats values as a Postgres array literal"""
+    elements = ['"' + x.replace("\\", "\\\\").replace('"', '\\"') + '"' for x in values]
+    return "{" + ",".join(elements) + "}"
+
+
+def to_rows(
+    records: Iterable[dict[str, Any]], public_ids: dict[str, str], stats: dict
+) -> Iterator[list[Any]]:
+    """
+    Yields the product row of each record, along with its images' public
+    ids as far as the image cache knows them. Records missing their id,
+    name or images are skipped.
+    """
+    for record in records:
+        product_id = record["objectID"].split("_", 1)[1]
+        images = record.get("images", record.get("variant_images"))
+        if not product_id.isdigit() or not record.get("name") or not images:
+            stats["skipped"] += 1
+            continue
+
+        stats["records"] += 1
+        ids = [public_ids[x] for x in dict.fromkeys(images) if x in public_ids]
+        yield [int(product_id), record["name"], images[0], to_array(ids)]
+
+
+def copy_rows(cursor, rows: Iterable[list[Any]]):
+    """Copies the rows into restored_products, BATCH_SIZE at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % BATCH_SIZE == 0:
+            flush_rows(cursor, buffer)
+    flush_rows(cursor, buffer)
+
+
+def flush_rows(cursor, buffer: io.StringIO):
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY restored_products (id, name, preview, images) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def restore_business(business_id: int, business_name: str) -> dict[str, int]:
+    """
+    Restores the business's products missing from Postgres. Returns the
+    number of products restored, skipped and conflicting.
+    """
+    stats = {"records": 0, "restored": 0, "skipped": 0, "conflicting": 0}
+    with get_connection(autocommit=False) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT secure_url, public_id FROM image_cache WHERE business_id=(%s)",
+                (str(business_id),),
+            )
+            public_ids = {x["secure_url"]: x["public_id"] for x in cursor.fetchall()}
+
+            cursor.execute("""
+                CREATE TEMPORARY TABLE restored_products (
+                    id INTEGER, name TEXT, preview TEXT, images TEXT[]
+                ) ON COMMIT DROP
+                """)
+            records = lib.algoliasearch.browse_business(
+                lib.algoliasearch.get_index(),
+                business_id,
+                business_name,
+                ["name", "images", "variant_images"],
+            )
+            copy_rows(cursor, to_rows(records, public_ids, stats))
+
+            cursor.execute(
+                """
+                SELECT COUNT(*) AS count FROM restored_products
+                WHERE EXISTS (
+                    SELECT 1 FROM products
+                    WHERE products.business_id=%s AND products.id=restored_products.id
+                ) AND NOT EXISTS (
+                    SELECT 1 FROM products
+                    WHERE products.business_id=%s AND products.id=restored_products.id
+                    AND products.name=restored_products.name
+                    AND products.preview=restored_products.preview
+                )
+                """,
+                (business_id, business_id),
+            )
+            stats["conflicting"] = cursor.fetchone()["count"]
+
+            cursor.execute(
+                """
+                INSERT INTO products (business_id, id, name, preview, images)
+                SELECT %s, id, name, preview, images FROM restored_products
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM products
+                    WHERE products.business_id=%s AND products.id=restored_products.id
+                )
+                """,
+                (business_id, business_id),
+            )
+            stats["restored"] = cursor.rowcount
+
+            # Syncs must not hand out the ids of restored products again
+            cursor.execute(
+                """
+                UPDATE businesses SET next_product_id=GREATEST(
+                    next_product_id, (SELECT MAX(id) + 1 FROM restored_products)
+                )
+                WHERE id=%s
+                """,
+                (business_id,),
+            )
+
+    stats["skipped"] += stats["records"] - stats["restored"] - stats["conflicting"]
+    del stats["records"]
+    return stats
+
+
+def restore(business_ids: list[int]) -> dict[int, Optional[dict[str, Any]]]:
+    """
+    Restores the products of the businesses, WORKERS at a time. Returns
+    the stats of each business, None for those that were syncing, and
+    the error of those that failed to restore. Syncs that were queued for
+    the businesses run once they are restored.
+    """
+    worker = f"restore:{os.environ.get('DYNO', socket.gethostname())}:{os.getpid()}"
+
+    def run(record: dict[str, Any]) -> Optional[dict[str, Any]]:
+        job = lib.jobs.hold(record["id"], worker)
+        if job is None:
+            print(f"Skipped {record['name']}, it is syncing")
+            return None
+        try:
+            stats = restore_business(record["id"], record["name"])
+        except Exception as e:
+            print(f"Failed to restore {record['name']}: {e}")
+            return {"error": str(e)}
+        finally:
+            lib.jobs.release(job, worker)
+        print(
+            f"Restored {stats['restored']}, skipped {stats['skipped']} and found {stats['conflicting']} conflicting products of {record['name']}"
+        )
+        return stats
+
+    records = lib.upload.get_businesses(business_ids)
+    with lib.jobs.heartbeat(lambda: lib.jobs.renew_all(worker), worker):
+        with ThreadPoolExecutor(WORKERS) as executor:
+            results = dict(zip([x["id"] for x in records], executor.map(run, records)))
+
+    total = {"restored": 0, "skipped": 0, "conflicting": 0}
+    failed = 0
+    for stats in filter(None, results.values()):
+        if "error" in stats:
+            failed += 1
+            continue
+        for key in total:
+            total[key] += stats[key]
+    print(
+        f"Restored {total['restored']}, skipped {total['skipped']} and found {total['conflicting']} conflicting products in total"
+    )
+    if failed > 0:
+        print(f"Failed to restore {failed} businesses")
+    return results
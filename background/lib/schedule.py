@@ -0,0 +1,134 @@
+import os
+from lib.postgresql import get_connection
+
+"""
+WHEN EACH BUSINESS SYNCS
+
+Every business has its own refresh interval in sync_schedule. It shrinks
+while syncs keep finding a good share of the catalog changed and grows
+while they find nothing, between MIN_INTERVAL_HOURS and MAX_INTERVAL_HOURS.
+A business never spends more than MAX_DUTY of its interval syncing.
+Businesses start out staggered across one interval, and each sync schedules
+the next from its own start time, so syncs stay spread over the week.
+"""
+
+MIN_INTERVAL_HOURS = float(os.environ.get("SCHEDULE_MIN_INTERVAL_HOURS", "24"))
+MAX_INTERVAL_HOURS = float(os.environ.get("SCHEDULE_MAX_INTERVAL_HOURS", "168"))
+
+# Share of the catalog changed since the last sync above
+# which the interval halves, when nothing changed it grows
+CHANGE_TARGET = float(os.environ.get("SCHEDULE_CHANGE_TARGET", "0.05"))
+GROWTH = 1.5
+
+# Most of its interval a business may spend syncing
+MAX_DUTY = float(os.environ.get("SCHEDULE_MAX_DUTY", "0.05"))
+
+
+def next_interval(
+    interval_hours: float, stats: dict[str, int], duration_seconds: float
+) -> float:
+    changed = stats["inserted"] + stats["updated"] + stats["deleted"]
+    total = changed + stats["unchanged"]
+    if changed == 0:
+        interval_hours *= GROWTH
+    elif changed >= CHANGE_TARGET * total:
+        interval_hours /= 2
+
+    interval_hours = max(interval_hours, duration_seconds / 3600 / MAX_DUTY)
+    return min(max(interval_hours, MIN_INTERVAL_HOURS), MAX_INTERVAL_HOURS)
+
+
+def schedule_new():
+    """
+    Schedules the businesses that have no schedule yet, spread over the
+    longest interval by their id so none of them start at the same time
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO sync_schedule (business_id, interval_hours, next_run_at)
+                SELECT id, %s, NOW() + make_interval(secs => (id * 0.6180339887 %% 1) * %s * 3600)
+                FROM businesses
+                ON CONFLICT (business_id) DO NOTHING
+                """,
+                (MAX_INTERVAL_HOURS, MAX_INTERVAL_HOURS),
+            )
+
+
+def claim_due(limit: int) -> list[int]:
+    """
+    Returns the ids of up to limit businesses due to sync, most overdue
+    first. Their next run moves a whole interval ahead, retrying failed
+    syncs in the meantime is up to lib.jobs.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE sync_schedule SET last_started_at=NOW(),
+                next_run_at=NOW() + make_interval(secs => interval_hours * 3600)
+                WHERE business_id IN (
+                    SELECT business_id FROM sync_schedule
+                    WHERE next_run_at <= NOW()
+                    ORDER BY next_run_at LIMIT %s
+                )
+                RETURNING business_id
+                """,
+                (limit,),
+            )
+            return [x["business_id"] for x in cursor.fetchall()]
+
+
+def record_sync(business_id: int, stats: dict[str, int], duration_seconds: float):
+    """
+    Adapts the business's interval to the sync that just completed and
+    moves its next run accordingly, unless a refresh was requested since
+    """
+    with get_connection(autocommit=False) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT interval_hours FROM sync_schedule WHERE business_id=(%s) FOR UPDATE",
+                (str(business_id),),
+            )
+            record = cursor.fetchone()
+            if record is None:
+                return
+
+            interval_hours = next_interval(
+                record["interval_hours"], stats, duration_seconds
+            )
+            cursor.execute(
+                """
+                UPDATE sync_schedule SET interval_hours=%s,
+                next_run_at=CASE
+                    WHEN next_run_at=last_started_at + make_interval(secs => interval_hours * 3600)
+                    THEN last_started_at + make_interval(secs => %s)
+                    ELSE next_run_at
+                END,
+                last_duration_seconds=%s, last_changes=%s, last_products=%s
+                WHERE business_id=%s
+                """,
+                (
+                    interval_hours,
+                    interval_hours * 3600,
+                    duration_seconds,
+                    stats["inserted"] + stats["updated"] + stats["deleted"],
+                    stats["inserted"] + stats["updated"] + stats["unchanged"],
+                    business_id,
+                ),
+            )
+
+
+def request_refresh(business_id: int):
+    """Makes the business due now, it syncs on the next tick"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO sync_schedule (business_id, interval_hours, next_run_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (business_id) DO UPDATE SET next_run_at=NOW()
+                """,
+                (business_id, MAX_INTERVAL_HOURS),
+            )
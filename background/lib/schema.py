@@ -0,0 +1,75 @@
+from lib.postgresql import get_connection
+
+# Idempotent DDL for the columns and tables owned by the background tier. Every
+# statement must be safe to rerun, they are applied each time a process starts.
+MIGRATIONS = [
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS source_id TEXT",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS fingerprint TEXT",
+    "CREATE INDEX IF NOT EXISTS products_business_id_source_id_idx ON products (business_id, source_id)",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS images TEXT[]",
+    """
+    CREATE TABLE IF NOT EXISTS image_cache (
+        business_id INTEGER NOT NULL,
+        source_url TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        public_id TEXT NOT NULL,
+        secure_url TEXT NOT NULL,
+        last_used_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (business_id, source_url, fingerprint)
+    )
+    """,
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS last_seen_run INTEGER",
+    """
+    CREATE TABLE IF NOT EXISTS sync_runs (
+        business_id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL,
+        cursor TEXT,
+        status TEXT NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_schedule (
+        business_id INTEGER PRIMARY KEY,
+        interval_hours DOUBLE PRECISION NOT NULL,
+        next_run_at TIMESTAMP NOT NULL,
+        last_started_at TIMESTAMP,
+        last_duration_seconds DOUBLE PRECISION,
+        last_changes INTEGER,
+        last_products INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS sync_schedule_next_run_at_idx ON sync_schedule (next_run_at)",
+    """
+    CREATE TABLE IF NOT EXISTS sync_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        business_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+        lease_until TIMESTAMP,
+        worker TEXT,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS sync_jobs_active_business_id_idx ON sync_jobs (business_id) WHERE status IN ('queued', 'running')",
+    "CREATE INDEX IF NOT EXISTS sync_jobs_status_run_after_idx ON sync_jobs (status, run_after)",
+    # Unix times, compared against the providers' own modification times
+    "ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS since DOUBLE PRECISION",
+    "ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS started_at DOUBLE PRECISION",
+    "ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS last_full_at DOUBLE PRECISION",
+    "ALTER TABLE sync_runs ADD COLUMN IF NOT EXISTS basis TEXT",
+]
+
+
+def migrate():
+    # The clock and every worker migrate on start, the lock keeps
+    # them from racing to create the same table, and is released
+    # when the transaction commits
+    with get_connection(autocommit=False) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('lib.schema'))")
+            for statement in MIGRATIONS:
+                cursor.execute(statement)
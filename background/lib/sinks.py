@@ -0,0 +1,508 @@
+import cloudinary.api
+import cloudinary.uploader
+import contextlib
+import json
+import lib.ratelimit
+import os
+import psycopg2.extras
+import threading
+from lib.algoliasearch import get_index
+from lib.postgresql import get_connection
+from typing import Any, Iterator, Optional
+
+"""
+WHERE THE SYNC WRITES TO
+
+A sync writes records to a search index, image copies to an image
+store and rows to a relational store. Each has a production backend
+(Algolia, Cloudinary and Postgres), an in-memory one and a local-file
+one, so that a crawl can be run end to end without touching production.
+
+Search indexes follow the subset of Algolia's SearchIndex the sync
+uses, so the production backend is the SearchIndex itself.
+"""
+
+# Columns of the product rows passed to write_products
+PRODUCT_COLUMNS = (
+    "business_id",
+    "id",
+    "name",
+    "preview",
+    "source_id",
+    "fingerprint",
+    "images",
+    "last_seen_run",
+)
+
+# Fields of the sync runs passed to save_sync_run
+SYNC_RUN_FIELDS = (
+    "run_id",
+    "cursor",
+    "status",
+    "since",
+    "started_at",
+    "last_full_at",
+    "basis",
+)
+
+# Columns of the image cache rows passed to save_images
+IMAGE_COLUMNS = ("business_id", "source_url", "fingerprint", "public_id", "secure_url")
+
+
+class DoneResponse:
+    """Response of a write that is already applied"""
+
+    def wait(self):
+        return self
+
+
+def read_json(path: str, default: Any) -> Any:
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path: str, data: Any):
+    # Written next to the file and renamed over it,
+    # so a crash never leaves half a file behind
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class MemoryIndex:
+    """Search index kept in a dict of records by objectID"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}
+
+    def save_objects(
+        self, objects: list[dict[str, Any]], request_options=None
+    ) -> DoneResponse:
+        with self.lock:
+            for record in objects:
+                self.objects[record["objectID"]] = record
+            self.changed()
+        return DoneResponse()
+
+    def partial_update_objects(
+        self, objects: list[dict[str, Any]], request_options=None
+    ) -> DoneResponse:
+        # Like Algolia without createIfNotExists, missing records stay missing
+        with self.lock:
+            for record in objects:
+                if record["objectID"] in self.objects:
+                    self.objects[record["objectID"]].update(record)
+            self.changed()
+        return DoneResponse()
+
+    def delete_objects(self, object_ids: list[str], request_options=None):
+        with self.lock:
+            for object_id in object_ids:
+                self.objects.pop(object_id, None)
+            self.changed()
+        return DoneResponse()
+
+    def changed(self):
+        pass
+
+
+class FileIndex(MemoryIndex):
+    """MemoryIndex saved to a JSON file after every write"""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.objects = read_json(path, {})
+
+    def changed(self):
+        write_json(self.path, self.objects)
+
+
+class CloudinaryImageStore:
+    def upload(self, source_url: str, public_id: str) -> dict[str, str]:
+        """Copies the image at source_url to public_id, converted to WebP"""
+        lib.ratelimit.acquire("api.cloudinary.com")
+        url_data = cloudinary.uploader.upload(
+            source_url,
+            format="webp",
+            public_id=public_id,
+            unique_filename=False,
+            overwrite=True,
+            exif=False,
+        )
+        return {
+            "public_id": url_data["public_id"],
+            "secure_url": url_data["secure_url"],
+        }
+
+    def delete(self, public_ids: list[str]):
+        cloudinary.api.delete_resources(public_ids)
+
+    def delete_prefix(self, prefix: str):
+        cloudinary.api.delete_resources_by_prefix(prefix)
+
+
+class MemoryImageStore:
+    """
+    Image store that only remembers the source of every public id,
+    images are never downloaded
+    """
+
+    def __init__(self, base_url: str = "memory://images"):
+        self.lock = threading.Lock()
+        self.base_url = base_url
+        self.images = {}
+
+    def upload(self, source_url: str, public_id: str) -> dict[str, str]:
+        with self.lock:
+            self.images[public_id] = source_url
+            self.changed({public_id: source_url})
+        return {
+            "public_id": public_id,
+            "secure_url": f"{self.base_url}/{public_id}.webp",
+        }
+
+    def delete(self, public_ids: list[str]):
+        with self.lock:
+            deleted = {x: None for x in public_ids if x in self.images}
+            for public_id in deleted:
+                del self.images[public_id]
+            self.changed(deleted)
+
+    def delete_prefix(self, prefix: str):
+        with self.lock:
+            deleted = {x: None for x in self.images if x.startswith(prefix)}
+            for public_id in deleted:
+                del self.images[public_id]
+            self.changed(deleted)
+
+    def changed(self, images: dict[str, Optional[str]]):
+        pass
+
+
+class FileImageStore(MemoryImageStore):
+    """
+    MemoryImageStore saved to a file of JSON lines, each mapping public
+    ids to their source or to null once deleted. Lines are appended as
+    images change, as there is one upload per new image.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(f"file://{os.path.abspath(os.path.dirname(path))}")
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    self.images.update(json.loads(line))
+            self.images = {k: v for k, v in self.images.items() if v is not None}
+
+    def changed(self, images: dict[str, Optional[str]]):
+        if len(images) > 0:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(images) + "\n")
+
+
+class PostgresTransaction:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def write_products(self, inserts: list[tuple], updates: list[tuple]):
+        psycopg2.extras.execute_values(
+            self.cursor,
+            "INSERT INTO products (business_id, id, name, preview, source_id, fingerprint, images, last_seen_run) VALUES %s",
+            inserts,
+            page_size=1000,
+        )
+        psycopg2.extras.execute_values(
+            self.cursor,
+            """
+            UPDATE products SET name=data.name, preview=data.preview, fingerprint=data.fingerprint, images=data.images, last_seen_run=data.last_seen_run
+            FROM (VALUES %s) AS data (business_id, id, name, preview, source_id, fingerprint, images, last_seen_run)
+            WHERE products.business_id=data.business_id AND products.id=data.id
+            """,
+            updates,
+            page_size=1000,
+        )
+
+    def mark_seen(self, business_id: int, product_ids: list[int], run_id: int):
+        if len(product_ids) > 0:
+            self.cursor.execute(
+                "UPDATE products SET last_seen_run=(%s) WHERE business_id=(%s) AND id=ANY(%s)",
+                (run_id, str(business_id), product_ids),
+            )
+
+    def delete_products(self, business_id: int, product_ids: list[int]):
+        self.cursor.execute(
+            "DELETE FROM products WHERE business_id=(%s) AND id IN %s",
+            (str(business_id), tuple(product_ids)),
+        )
+
+    def save_sync_run(self, business_id: int, run: dict[str, Any]):
+        self.cursor.execute(
+            """
+            INSERT INTO sync_runs (business_id, run_id, cursor, status, since, started_at, last_full_at, basis)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (business_id) DO UPDATE
+            SET run_id=EXCLUDED.run_id, cursor=EXCLUDED.cursor, status=EXCLUDED.status,
+            since=EXCLUDED.since, started_at=EXCLUDED.started_at, last_full_at=EXCLUDED.last_full_at,
+            basis=EXCLUDED.basis, updated_at=NOW()
+            """,
+            (
+                business_id,
+                run["run_id"],
+                json.dumps(run["cursor"]),
+                run["status"],
+                run["since"],
+                run["started_at"],
+                run["last_full_at"],
+                run["basis"],
+            ),
+        )
+
+
+class PostgresStore:
+    def get_products(self, business_id: int) -> list[dict[str, Any]]:
+        """
+        Returns the id, preview, source_id, fingerprint, images
+        and last_seen_run of the business's products
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id, preview, source_id, fingerprint, images, last_seen_run FROM products WHERE business_id=(%s)",
+                    (str(business_id),),
+                )
+                return cursor.fetchall()
+
+    def get_sync_run(self, business_id: int) -> Optional[dict[str, Any]]:
+        """Returns the business's last sync run, with the fields in SYNC_RUN_FIELDS"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {', '.join(SYNC_RUN_FIELDS)} FROM sync_runs WHERE business_id=(%s)",
+                    (str(business_id),),
+                )
+                record = cursor.fetchone()
+        if record is None:
+            return None
+        return {**record, "cursor": json.loads(record["cursor"])}
+
+    def reserve_product_ids(self, business_id: int, count: int, minimum: int) -> int:
+        """
+        Reserves count consecutive product ids for the business, none below
+        minimum, and returns the first. The increment is a single statement,
+        so concurrent syncs of the business always get distinct blocks.
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE businesses SET next_product_id=GREATEST(next_product_id, %s) + %s
+                    WHERE id=(%s) RETURNING next_product_id
+                    """,
+                    (minimum, count, str(business_id)),
+                )
+                return cursor.fetchone()["next_product_id"] - count
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[PostgresTransaction]:
+        """Yields a transaction that is committed on exit, or rolled back on error"""
+        with get_connection(autocommit=False) as conn:
+            with conn.cursor() as cursor:
+                yield PostgresTransaction(cursor)
+
+    def get_images(self, business_id: int) -> list[dict[str, Any]]:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT source_url, fingerprint, public_id, secure_url FROM image_cache WHERE business_id=(%s)",
+                    (str(business_id),),
+                )
+                return cursor.fetchall()
+
+    def save_images(self, rows: list[tuple]):
+        """Upserts image cache rows, marking them as used now"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    """
+                    INSERT INTO image_cache (business_id, source_url, fingerprint, public_id, secure_url) VALUES %s
+                    ON CONFLICT (business_id, source_url, fingerprint) DO UPDATE
+                    SET public_id=EXCLUDED.public_id, secure_url=EXCLUDED.secure_url, last_used_at=NOW()
+                    """,
+                    rows,
+                    page_size=1000,
+                )
+
+    def clear_images(self, business_id: int):
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM image_cache WHERE business_id=(%s)",
+                    (str(business_id),),
+                )
+
+
+class MemoryTransaction:
+    """Queues writes until the transaction is applied to the tables"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write_products(self, inserts: list[tuple], updates: list[tuple]):
+        self.writes.append(("write_products", inserts + updates))
+
+    def mark_seen(self, business_id: int, product_ids: list[int], run_id: int):
+        self.writes.append(("mark_seen", (business_id, product_ids, run_id)))
+
+    def delete_products(self, business_id: int, product_ids: list[int]):
+        self.writes.append(("delete_products", (business_id, product_ids)))
+
+    def save_sync_run(self, business_id: int, run: dict[str, Any]):
+        self.writes.append(("save_sync_run", (business_id, dict(run))))
+
+    def apply(self, tables: dict[str, dict]):
+        products = tables["products"]
+        for write, args in self.writes:
+            if write == "write_products":
+                for row in args:
+                    product = dict(zip(PRODUCT_COLUMNS, row))
+                    products[f"{product['business_id']}_{product['id']}"] = product
+            elif write == "mark_seen":
+                business_id, product_ids, run_id = args
+                for product_id in product_ids:
+                    products[f"{business_id}_{product_id}"]["last_seen_run"] = run_id
+            elif write == "delete_products":
+                business_id, product_ids = args
+                for product_id in product_ids:
+                    products.pop(f"{business_id}_{product_id}", None)
+            else:
+                business_id, run = args
+                tables["sync_runs"][str(business_id)] = run
+
+
+class MemoryStore:
+    """
+    Relational store kept in dicts. Writes made in a transaction
+    are applied together once the transaction succeeds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {
+            "products": {},
+            "next_product_ids": {},
+            "sync_runs": {},
+            "images": {},
+        }
+
+    def get_products(self, business_id: int) -> list[dict[str, Any]]:
+        with self.lock:
+            return [
+                {
+                    k: x.get(k)
+                    for k in (
+                        "id",
+                        "preview",
+                        "source_id",
+                        "fingerprint",
+                        "images",
+                        "last_seen_run",
+                    )
+                }
+                for x in self.tables["products"].values()
+                if x["business_id"] == int(business_id)
+            ]
+
+    def get_sync_run(self, business_id: int) -> Optional[dict[str, Any]]:
+        with self.lock:
+            run = self.tables["sync_runs"].get(str(business_id))
+            return {k: run.get(k) for k in SYNC_RUN_FIELDS} if run else None
+
+    def reserve_product_ids(self, business_id: int, count: int, minimum: int) -> int:
+        with self.lock:
+            next_product_ids = self.tables["next_product_ids"]
+            start = max(next_product_ids.get(str(business_id), 0), minimum)
+            next_product_ids[str(business_id)] = start + count
+            self.changed()
+            return start
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[MemoryTransaction]:
+        transaction = MemoryTransaction()
+        yield transaction
+        with self.lock:
+            transaction.apply(self.tables)
+            self.changed()
+
+    def get_images(self, business_id: int) -> list[dict[str, Any]]:
+        with self.lock:
+            return [
+                dict(x)
+                for x in self.tables["images"].values()
+                if x["business_id"] == int(business_id)
+            ]
+
+    def save_images(self, rows: list[tuple]):
+        with self.lock:
+            for row in rows:
+                image = dict(zip(IMAGE_COLUMNS, row))
+                key = json.dumps(row[:3])
+                self.tables["images"][key] = image
+            self.changed()
+
+    def clear_images(self, business_id: int):
+        with self.lock:
+            images = self.tables["images"]
+            for key in [
+                k for k, x in images.items() if x["business_id"] == int(business_id)
+            ]:
+                del images[key]
+            self.changed()
+
+    def changed(self):
+        pass
+
+
+class FileStore(MemoryStore):
+    """MemoryStore saved to a JSON file after every committed write"""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.tables.update(read_json(path, {}))
+
+    def changed(self):
+        write_json(self.path, self.tables)
+
+
+class Sinks:
+    """The search index, image store and relational store a sync writes to"""
+
+    def __init__(self, index, images, store):
+        self.index = index
+        self.images = images
+        self.store = store
+
+
+def production(index=None) -> Sinks:
+    """Algolia, Cloudinary and Postgres, writing to the live index unless given another"""
+    return Sinks(index or get_index(), CloudinaryImageStore(), PostgresStore())
+
+
+def memory() -> Sinks:
+    return Sinks(MemoryIndex(), MemoryImageStore(), MemoryStore())
+
+
+def local(directory: str) -> Sinks:
+    """Sinks saved as JSON files in directory, kept between runs"""
+    os.makedirs(directory, exist_ok=True)
+    return Sinks(
+        FileIndex(os.path.join(directory, "index.json")),
+        FileImageStore(os.path.join(directory, "images.jsonl")),
+        FileStore(os.path.join(directory, "store.json")),
+    )
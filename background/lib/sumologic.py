@@ -1,23 +1,147 @@
+import atexit
 import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 from sumologic import SumoLogic
 
-sumo = SumoLogic(
-    os.environ["SUMOLOGIC_ACCESS_ID"],
-    os.environ["SUMOLOGIC_ACCESS_KEY"],
-    endpoint=os.environ["SUMOLOGIC_URL"],
-)
+# Events waiting to be shipped before new ones are dropped, the most
+# events per post, and how long an event waits for a batch to fill up
+QUEUE_SIZE = int(os.environ.get("SUMOLOGIC_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.environ.get("SUMOLOGIC_BATCH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.environ.get("SUMOLOGIC_FLUSH_INTERVAL", "5"))
 
+# Seconds the process waits at exit for queued events to be shipped
+EXIT_TIMEOUT = float(os.environ.get("SUMOLOGIC_EXIT_TIMEOUT", "10"))
 
-def post(level: str, message: str, method: str = None, params: dict[str, str] = None):
-    sumo.post(
-        "",
-        {
-            "date": datetime.now().strftime("%m/%d/%Y, %H:%M:%S"),
-            "level": level,
-            "message": message,
-            "method": method,
-            "params": params,
-        },
+
+def create_client() -> SumoLogic:
+    return SumoLogic(
+        os.environ["SUMOLOGIC_ACCESS_ID"],
+        os.environ["SUMOLOGIC_ACCESS_KEY"],
+        endpoint=os.environ["SUMOLOGIC_URL"],
     )
+
+
+class Shipper:
+    """
+    Ships events to Sumo Logic in batches from a background thread, so
+    posting never waits on the network. When the queue is full, events
+    are dropped and counted instead, and the count is shipped along with
+    the next batch.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = QUEUE_SIZE,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+    ):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.client = None
+        self.thread = None
+        self.stats = {"shipped": 0, "dropped": 0, "failed": 0}
+        self.unreported_drops = 0
+
+    def post(self, event: dict):
+        self.start()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            with self.lock:
+                self.stats["dropped"] += 1
+                self.unreported_drops += 1
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until every event posted so far is shipped, or timeout seconds"""
+        if self.thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return dict(self.stats)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = []
+            flushes = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and len(flushes) == 0:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    flushes.append(item)
+                else:
+                    batch.append(item)
+
+            self.ship(batch)
+            for done in flushes:
+                done.set()
+
+    def ship(self, batch: list[dict]):
+        with self.lock:
+            dropped = self.unreported_drops
+            self.unreported_drops = 0
+        if dropped > 0:
+            batch.append(make_event("warning", f"Dropped {dropped} log events"))
+        if len(batch) == 0:
+            return
+
+        # Sumo Logic HTTP sources take one message per line
+        try:
+            if self.client is None:
+                self.client = create_client()
+            endpoint = self.client.get_versioned_endpoint(self.client.DEFAULT_VERSION)
+            r = self.client.session.post(
+                endpoint, data="\n".join(map(json.dumps, batch))
+            )
+            r.raise_for_status()
+            with self.lock:
+                self.stats["shipped"] += len(batch)
+        except Exception as e:
+            print(f"Failed to ship {len(batch)} log events: {e}")
+            with self.lock:
+                self.stats["failed"] += len(batch)
+
+
+def make_event(
+    level: str, message: str, method: str = None, params: dict[str, str] = None
+) -> dict:
+    return {
+        "date": datetime.now().strftime("%m/%d/%Y, %H:%M:%S"),
+        "level": level,
+        "message": message,
+        "method": method,
+        "params": params,
+    }
+
+
+shipper = Shipper()
+atexit.register(shipper.flush, EXIT_TIMEOUT)
+
+
+def post(level: str, message: str, method: str = None, params: dict[str, str] = None):
+    shipper.post(make_event(level, message, method, params))
+
+
+def flush(timeout: float = None) -> bool:
+    return shipper.flush(timeout)
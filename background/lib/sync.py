@@ -0,0 +1,543 @@
+import functools
+import hashlib
+import json
+import lib.images
+import lib.pipeline
+import lib.sinks
+import lib.telemetry
+import os
+import threading
+import time
+from lib.algoliasearch import BatchWriter
+from lib.normalize import count_visible, unescape
+from typing import Any, Callable, Iterable, Optional
+
+# Bump whenever to_record changes, so that every product
+# gets rewritten in the new format on its next sync
+RECORD_VERSION = 3
+
+# Seconds between checkpoints of a sync's progress. Each one sends the
+# buffered records to the index, so shorter ones mean smaller batches.
+CHECKPOINT_INTERVAL = float(os.environ.get("SYNC_CHECKPOINT_INTERVAL", "30"))
+
+# Days between full syncs. The syncs in between only fetch what changed
+# since the previous one started, which some providers can't do without
+# leaving out the products that were deleted.
+FULL_SYNC_DAYS = float(os.environ.get("SYNC_FULL_INTERVAL_DAYS", "7"))
+
+# Seconds the watermark is moved back, covering clock skew between us
+# and the providers and products modified while the previous sync ran
+WATERMARK_OVERLAP = float(os.environ.get("SYNC_WATERMARK_OVERLAP_SECONDS", "3600"))
+
+# Product ids reserved from the business at a time. Ids left over when
+# a sync ends are skipped, larger blocks mean fewer round-trips.
+ID_BLOCK_SIZE = int(os.environ.get("SYNC_ID_BLOCK_SIZE", "100"))
+
+
+# Fields of a normalized product along with the record attributes
+# built from each. When only some of them change, only their
+# attributes are sent to the index.
+FIELD_ATTRIBUTES = {
+    "geolocation": ["_geoloc"],
+    "name": ["name"],
+    "description": ["description", "description_length"],
+    "departments": ["departments"],
+    "link": ["link"],
+    "price_range": ["price_range"],
+    "tags": ["tags", "tags_length"],
+    "variant_images": ["images", "variant_image_indices"],
+    "variant_tags": ["variant_tags"],
+}
+
+
+def digest(value: Any) -> str:
+    content = json.dumps(value, sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+
+def fingerprint(product: dict[str, Any], business_name: str) -> str:
+    # Everything that ends up in the Algolia record, so any change
+    # to the product or to the business itself triggers an update.
+    # Each field is hashed on its own, everything else together.
+    hashes = {x: digest(product[x]) for x in FIELD_ATTRIBUTES}
+    rest = {k: v for k, v in product.items() if k not in FIELD_ATTRIBUTES}
+    hashes["*"] = digest([RECORD_VERSION, business_name, rest])
+    return json.dumps(hashes, sort_keys=True)
+
+
+def changed_fields(old: Optional[str], new: str) -> Optional[list[str]]:
+    """
+    Returns the fields that differ between two fingerprints, or None when
+    the whole record has to be saved again, like when the old one predates
+    hashing each field on its own
+    """
+    try:
+        old_hashes = json.loads(old)
+    except (TypeError, ValueError):
+        return None
+    new_hashes = json.loads(new)
+    if not isinstance(old_hashes, dict) or old_hashes.get("*") != new_hashes["*"]:
+        return None
+    return [x for x in FIELD_ATTRIBUTES if old_hashes.get(x) != new_hashes[x]]
+
+
+def to_record(
+    business_id: int,
+    product_id: int,
+    business_name: str,
+    product: dict[str, Any],
+    variant_images: list[str],
+) -> dict[str, Any]:
+    # Variants mostly share their image, so each image is stored
+    # once and every variant points at one by its index
+    indices = {}
+    for variant_image in variant_images:
+        indices.setdefault(variant_image, len(indices))
+    return {
+        "objectID": f"{business_id}_{product_id}",
+        "_geoloc": product["geolocation"],
+        "name": product["name"],
+        "business": unescape(business_name),
+        "description": product["description"],
+        "description_length": count_visible(product["description"]),
+        "departments": product["departments"],
+        "link": product["link"],
+        "price_range": product["price_range"],
+        "tags": product["tags"],
+        "tags_length": count_visible("".join(product["tags"])),
+        "images": list(indices),
+        "variant_image_indices": [indices[x] for x in variant_images],
+        "variant_tags": product["variant_tags"],
+    }
+
+
+def to_partial_record(
+    business_id: int,
+    product_id: int,
+    business_name: str,
+    product: dict[str, Any],
+    variant_images: Optional[list[str]],
+    fields: list[str],
+) -> dict[str, Any]:
+    """
+    Returns the attributes of the record built from fields, variant_images
+    are only needed when they are one of them
+    """
+    record = to_record(
+        business_id, product_id, business_name, product, variant_images or []
+    )
+    partial = {"objectID": record["objectID"]}
+    for field in fields:
+        for attribute in FIELD_ATTRIBUTES[field]:
+            partial[attribute] = record[attribute]
+    return partial
+
+
+def get_basis(business_name: str, settings: Any) -> str:
+    """
+    Hashes everything besides the products themselves that their records
+    depend on. Products can only be skipped for being unmodified while it
+    stays the same.
+    """
+    content = json.dumps([RECORD_VERSION, business_name, settings], sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def plan_run(
+    previous: Optional[dict[str, Any]], basis: str, now: float
+) -> dict[str, Any]:
+    """
+    Returns the new sync run following the previous one. It fetches the
+    changes since the previous run started, unless a full sync is due.
+    """
+    run = {
+        "run_id": previous["run_id"] + 1 if previous is not None else 1,
+        "cursor": None,
+        "status": "running",
+        "since": None,
+        "started_at": now,
+        "last_full_at": None,
+        "basis": basis,
+    }
+    if previous is None or previous["status"] != "complete":
+        return run
+
+    run["last_full_at"] = previous["last_full_at"]
+    if (
+        previous["basis"] == basis
+        and previous["started_at"] is not None
+        and previous["last_full_at"] is not None
+        and now - previous["last_full_at"] < FULL_SYNC_DAYS * 86400
+    ):
+        run["since"] = previous["started_at"] - WATERMARK_OVERLAP
+    return run
+
+
+def upload_images(
+    images: lib.images.ImageCache, product: dict[str, Any], known: list[str] = ()
+) -> tuple[list[str], list[str]]:
+    """
+    Returns the Cloudinary url of every variant image of the product,
+    along with the public ids of the distinct images. Copies among the
+    known public ids are used without checking their source.
+    """
+    variant_images = []
+    public_ids = []
+    for variant_image in product["variant_images"]:
+        public_id, secure_url = images.upload(variant_image, known)
+        variant_images.append(secure_url)
+        if public_id not in public_ids:
+            public_ids.append(public_id)
+
+    return variant_images, public_ids
+
+
+class ProductIds:
+    """
+    Hands out new product ids from blocks reserved atomically in the
+    store, so syncs running at the same time never share an id
+    """
+
+    def __init__(self, store, business_id: int, minimum: int):
+        self.store = store
+        self.business_id = business_id
+        self.minimum = minimum
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.end_id = 0
+
+    def take(self) -> int:
+        with self.lock:
+            if self.next_id == self.end_id:
+                # Should another writer set the counter back, blocks
+                # still start after the ids this sync handed out
+                with lib.telemetry.span("db write"):
+                    self.next_id = self.store.reserve_product_ids(
+                        self.business_id,
+                        ID_BLOCK_SIZE,
+                        max(self.minimum, self.end_id),
+                    )
+                self.end_id = self.next_id + ID_BLOCK_SIZE
+            self.next_id += 1
+            return self.next_id - 1
+
+
+def sync_products(
+    business_id: int,
+    business_name: str,
+    fetch: Callable[
+        [Any, Optional[float]],
+        Iterable[tuple[Any, list[dict[str, Any]], Optional[list[str]]]],
+    ],
+    sinks: Optional[lib.sinks.Sinks] = None,
+    settings: Any = None,
+    rebuild: bool = False,
+) -> dict[str, int]:
+    """
+    Brings the business's stored products in line with the freshly
+    fetched ones, writing to the production sinks unless given others.
+    Products are matched on their source_id, so only products that are
+    new, changed or gone touch the search index, image store and
+    relational store.
+
+    fetch(cursor, since) yields each page of products along with the
+    cursor to resume after it, starting from the beginning when cursor
+    is None. Given a since Unix time, it may leave out the products not
+    modified since, yielding their source ids as unchanged instead, or
+    None for unchanged when it can't tell which products it left out.
+    Pages are fetched on a separate thread while the previous ones
+    upload. Progress is checkpointed every CHECKPOINT_INTERVAL seconds,
+    so a sync that stops partway resumes from its last checkpoint the
+    next time, and products are only deleted once the crawl completes
+    and has listed every product. settings are what the products were
+    fetched and normalized with, such as the homepage, location and upload
+    settings, a change of which forces a full sync.
+    A rebuild fetches every product and saves all of their records in
+    full, for filling an index other than the live one. The stored
+    products keep their old fingerprints and stale products are kept, so
+    the next sync redoes the changes in whichever index is live by then.
+    Returns the number of products in each category.
+    """
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    if sinks is None:
+        sinks = lib.sinks.production()
+    index = sinks.index
+    store = sinks.store
+
+    with lib.telemetry.span("db read"):
+        previous = store.get_sync_run(business_id)
+    resumed = not rebuild and previous is not None and previous["status"] == "running"
+
+    existing = {}
+    legacy_ids = []
+    max_product_id = -1
+    with lib.telemetry.span("db read"):
+        records = store.get_products(business_id)
+    for record in records:
+        max_product_id = max(max_product_id, int(record["id"]))
+        if record["source_id"] is None or record["source_id"] in existing:
+            legacy_ids.append(record["id"])
+            continue
+
+        existing[record["source_id"]] = record
+
+    if resumed:
+        run = previous
+        print(f"Resuming interrupted sync from {run['cursor']}")
+    else:
+        run = plan_run(previous, get_basis(business_name, settings), time.time())
+        # Legacy products get replaced, so they have to be fetched again
+        if rebuild or len(legacy_ids) > 0:
+            run["since"] = None
+        # Without a basis, the sync after a rebuild fetches every product
+        if rebuild:
+            run["basis"] = None
+        if run["since"] is not None:
+            print(f"Fetching products modified since {run['since']}")
+        with store.transaction() as transaction:
+            transaction.save_sync_run(business_id, run)
+    run_id = run["run_id"]
+    seen = {x for x, record in existing.items() if record["last_seen_run"] == run_id}
+
+    # Products written before fingerprinting existed can't be
+    # matched to their source, so they are replaced wholesale. A
+    # rebuild leaves them out of its index and to the next sync.
+    if len(legacy_ids) > 0 and not rebuild:
+        print("Removing unmatched products...")
+        with lib.telemetry.span("index write"):
+            index.delete_objects([f"{business_id}_{x}" for x in legacy_ids])
+        if len(existing) == 0:
+            sinks.images.delete_prefix(f"{business_id}/")
+            store.clear_images(business_id)
+        else:
+            for product_id in legacy_ids:
+                sinks.images.delete_prefix(f"{business_id}/{product_id}/")
+        with lib.telemetry.span("db write"), store.transaction() as transaction:
+            transaction.delete_products(business_id, legacy_ids)
+        stats["deleted"] += len(legacy_ids)
+
+    # Never hand out an id that is already taken, even
+    # if the business's counter fell behind its products
+    product_ids = ProductIds(store, business_id, max_product_id + 1)
+    images = lib.images.ImageCache(business_id, sinks)
+    inserts = []
+    updates = []
+    unchanged_ids = []
+
+    # Whether each page listed the products it left out for being unmodified
+    listed = []
+
+    def reserve_inserts():
+        # New products are stored before their records go out, so that a
+        # failed sync's retry reuses their ids rather than leaving records
+        # behind. Without a fingerprint or being seen, the retry saves
+        # them again, and their fingerprints are stored by the checkpoint.
+        if len(inserts) == 0:
+            return
+        rows = [(*row[:5], None, row[6], None) for row in inserts]
+        with lib.telemetry.span("db write"), store.transaction() as transaction:
+            transaction.write_products(rows, [])
+        updates.extend(inserts)
+        inserts.clear()
+
+    with BatchWriter(index, before_flush=reserve_inserts) as writer:
+
+        def checkpoint(stale_ids: list[int]):
+            # Records are sent to the index before the rows
+            # that let a resumed sync skip their products
+            writer.flush()
+            images.save()
+            with lib.telemetry.span("db write"), store.transaction() as transaction:
+                transaction.write_products(inserts, updates)
+                transaction.mark_seen(business_id, unchanged_ids, run_id)
+                if len(stale_ids) > 0:
+                    transaction.delete_products(business_id, stale_ids)
+                transaction.save_sync_run(business_id, run)
+            inserts.clear()
+            updates.clear()
+            unchanged_ids.clear()
+
+        last_checkpoint = time.monotonic()
+        try:
+            batches = fetch(run["cursor"], run["since"])
+            for cursor, batch, unchanged in lib.pipeline.prefetch(batches):
+                listed.append(unchanged is not None)
+                for source_id in unchanged or []:
+                    # Unmodified products that aren't stored were
+                    # filtered out by the previous sync, and still are
+                    record = existing.get(source_id)
+                    if record is None or source_id in seen:
+                        continue
+                    seen.add(source_id)
+                    unchanged_ids.append(int(record["id"]))
+                    stats["unchanged"] += 1
+
+                for product in batch:
+                    source_id = product["source_id"]
+                    if source_id in seen:
+                        continue
+                    seen.add(source_id)
+
+                    with lib.telemetry.span("fingerprint"):
+                        product_fingerprint = fingerprint(product, business_name)
+                    record = existing.get(source_id)
+                    unchanged = record and record["fingerprint"] == product_fingerprint
+                    if unchanged:
+                        unchanged_ids.append(int(record["id"]))
+                        stats["unchanged"] += 1
+                        if not rebuild:
+                            continue
+
+                    if record:
+                        product_id = int(record["id"])
+                        fields = changed_fields(
+                            record["fingerprint"], product_fingerprint
+                        )
+                    else:
+                        product_id = product_ids.take()
+                        fields = None
+
+                    images_changed = fields is None or "variant_images" in fields
+                    if images_changed or rebuild:
+                        # Copies of images that didn't change are used as is
+                        known = [] if images_changed else record["images"]
+                        variant_images, public_ids = upload_images(
+                            images, product, known
+                        )
+                        preview = variant_images[0]
+                    else:
+                        # Images that didn't change are neither checked nor uploaded
+                        variant_images = None
+                        preview = record["preview"]
+                        public_ids = record["images"]
+
+                    # Changes of a rebuild only reach the live index if
+                    # its index replaces it, the next sync makes sure
+                    stored_fingerprint = product_fingerprint
+                    if rebuild:
+                        stored_fingerprint = record["fingerprint"] if record else None
+
+                    if not unchanged:
+                        row = (
+                            int(business_id),
+                            product_id,
+                            product["name"],
+                            preview,
+                            source_id,
+                            stored_fingerprint,
+                            public_ids,
+                            run_id,
+                        )
+                        if record:
+                            updates.append(row)
+                            stats["updated"] += 1
+                        else:
+                            inserts.append(row)
+                            stats["inserted"] += 1
+
+                    if fields is None or rebuild:
+                        writer.save(
+                            to_record(
+                                business_id,
+                                product_id,
+                                business_name,
+                                product,
+                                variant_images,
+                            )
+                        )
+                    else:
+                        writer.partial_update(
+                            to_partial_record(
+                                business_id,
+                                product_id,
+                                business_name,
+                                product,
+                                variant_images,
+                                fields,
+                            )
+                        )
+
+                    print(f"Successfully uploaded product: {product['name']}")
+
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    run["cursor"] = cursor
+                    checkpoint([])
+                    last_checkpoint = time.monotonic()
+        finally:
+            # Uploaded images stay usable even if the sync itself fails
+            images.save()
+
+        # Products left out without being listed may still exist, only a
+        # sync that accounted for every product can delete. A rebuild leaves
+        # them to the next sync, which deletes them from the live index too.
+        if not rebuild and (run["since"] is None or (len(listed) > 0 and all(listed))):
+            stale_ids = [
+                int(record["id"])
+                for source_id, record in existing.items()
+                if source_id not in seen
+            ]
+        else:
+            stale_ids = []
+            stats["unchanged"] += len([x for x in existing if x not in seen])
+
+        run["cursor"] = None
+        run["status"] = "complete"
+        if run["since"] is None:
+            run["last_full_at"] = run["started_at"]
+        checkpoint(stale_ids)
+    stats["deleted"] += len(stale_ids)
+
+    # Their images are left to lib.images.collect_garbage
+    if len(stale_ids) > 0:
+        print("Removing stale products...")
+        with lib.telemetry.span("index write"):
+            index.delete_objects([f"{business_id}_{x}" for x in stale_ids])
+
+    return stats
+
+
+def upload_products(
+    provider: str,
+    fetch_products: Callable[..., Iterable[tuple[Any, list[dict[str, Any]], Any]]],
+    business_id: int,
+    homepage: str,
+    latitude: str,
+    longitude: str,
+    business_name: str,
+    upload_settings: dict[str, Any],
+    sinks: Optional[lib.sinks.Sinks] = None,
+    rebuild: bool = False,
+) -> dict[str, int]:
+    """
+    Syncs the business's products from its homepage with the provider's
+    fetch_products(homepage, latitude, longitude, upload_settings, cursor,
+    since), see sync_products
+    """
+    print(f"{provider} upload from {homepage}")
+
+    # Records carry the location and links to the homepage, and moving
+    # to another homepage or provider changes every product's source id
+    settings = {
+        "provider": provider,
+        "homepage": homepage,
+        "latitude": latitude,
+        "longitude": longitude,
+        "upload_settings": upload_settings,
+    }
+    stats = sync_products(
+        business_id,
+        business_name,
+        functools.partial(
+            fetch_products, homepage, latitude, longitude, upload_settings
+        ),
+        sinks,
+        settings,
+        rebuild,
+    )
+    print(
+        f"Inserted {stats['inserted']}, updated {stats['updated']}, deleted {stats['deleted']} and skipped {stats['unchanged']} unchanged products"
+    )
+
+    print(f"Finished uploading products from {homepage}")
+    return stats
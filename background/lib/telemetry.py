@@ -0,0 +1,139 @@
+import cProfile
+import contextlib
+import contextvars
+import functools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Iterator
+
+# The sync of the business with this id is profiled, saving
+# a cProfile profile and a tracemalloc snapshot to PROFILE_DIR
+PROFILE_BUSINESS = os.environ.get("PROFILE_BUSINESS")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Number of calls to and seconds spent in every stage of one business
+    sync. Stages running on several threads at once add up to more than
+    the sync's own duration.
+    """
+
+    def __init__(self, business_id: int, profiled: bool = False):
+        self.business_id = business_id
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.stages = {}
+
+        # Profiles of the other threads the sync ran on
+        self.profiles = [] if profiled else None
+
+    def add(self, stage: str, seconds: float):
+        with self.lock:
+            calls, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (calls + 1, total + seconds)
+
+    def summary(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "business_id": self.business_id,
+                "seconds": round(time.monotonic() - self.start, 3),
+                "stages": {
+                    stage: {"calls": calls, "seconds": round(seconds, 3)}
+                    for stage, (calls, seconds) in self.stages.items()
+                },
+            }
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Adds the time spent inside to the stage of the current trace, if any"""
+    trace = _trace.get()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add(stage, time.monotonic() - start)
+
+
+def propagate(fn: Callable) -> Callable:
+    """
+    Wraps fn to add to the current trace, and be profiled along with
+    it, when run on another thread. Threads don't inherit the trace.
+    """
+    trace = _trace.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _trace.set(trace)
+        try:
+            if trace is None or trace.profiles is None:
+                return fn(*args, **kwargs)
+
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(fn, *args, **kwargs)
+            finally:
+                with trace.lock:
+                    trace.profiles.append(profiler)
+        finally:
+            _trace.reset(token)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def profile(trace: Trace) -> Iterator[None]:
+    """
+    Saves a profile of the code inside, merged with the profiles of the
+    threads it propagated the trace to, and a snapshot of the memory it
+    allocated. tracemalloc sees the whole process, so other businesses
+    syncing at the same time show up in the snapshot too.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(
+        PROFILE_DIR, f"{trace.business_id}-{time.strftime('%Y%m%d-%H%M%S')}"
+    )
+
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        stats = pstats.Stats(profiler)
+        with trace.lock:
+            for thread_profiler in trace.profiles:
+                stats.add(thread_profiler)
+        stats.dump_stats(f"{prefix}.prof")
+        snapshot.dump(f"{prefix}.tracemalloc")
+        print(f"Saved profile to {prefix}.prof and allocations to {prefix}.tracemalloc")
+
+
+@contextlib.contextmanager
+def trace(business_id: int) -> Iterator[Trace]:
+    """
+    Collects the stage timings of the business sync run inside,
+    profiling it if the business is PROFILE_BUSINESS
+    """
+    profiled = PROFILE_BUSINESS is not None and str(business_id) == PROFILE_BUSINESS
+    current = Trace(business_id, profiled)
+    token = _trace.set(current)
+    try:
+        if profiled:
+            with profile(current):
+                yield current
+        else:
+            yield current
+    finally:
+        _trace.reset(token)
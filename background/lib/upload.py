@@ -0,0 +1,92 @@
+import html
+import json
+import lib.etsy
+import lib.shopify
+import lib.sinks
+import lib.square
+import lib.sumologic
+import lib.telemetry
+from lib.postgresql import get_connection
+from typing import Any, Optional
+
+# Homepage key, upload settings key, Sumo Logic method and uploader of each provider
+PROVIDERS = [
+    ("shopifyHomepage", "shopify", "Shopify", lib.shopify.upload),
+    ("etsyHomepage", "etsy", "Etsy", lib.etsy.upload),
+    ("squareHomepage", "square", "Square", lib.square.upload),
+]
+
+BUSINESS_COLUMNS = (
+    "businesses.id, name, homepages, latitude, longitude, upload_settings"
+)
+
+
+def get_businesses(business_ids: Optional[list[int]] = None) -> list[dict[str, Any]]:
+    """Returns the businesses with these ids, or all of them"""
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            if business_ids is None:
+                cursor.execute(f"SELECT {BUSINESS_COLUMNS} FROM businesses")
+            else:
+                cursor.execute(
+                    f"SELECT {BUSINESS_COLUMNS} FROM businesses WHERE id=ANY(%s)",
+                    (business_ids,),
+                )
+            return cursor.fetchall()
+
+
+def sync_business(
+    record: dict[str, Any],
+    sinks: Optional[lib.sinks.Sinks] = None,
+    rebuild: bool = False,
+) -> Optional[dict[str, int]]:
+    """
+    Syncs the business's products from the first provider it has a
+    homepage for, see lib.sync.sync_products for rebuild. Returns the
+    sync's stats, or None without a homepage. Errors are reported to
+    Sumo Logic and raised again.
+    """
+    business_id = record["id"]
+    business_name = record["name"]
+    latitude = record["latitude"]
+    longitude = record["longitude"]
+    upload_settings = json.loads(html.unescape(record["upload_settings"]))
+    homepages = json.loads(html.unescape(record["homepages"]))
+
+    for homepage_key, settings_key, method, provider_upload in PROVIDERS:
+        if homepage_key not in homepages or not homepages[homepage_key]:
+            continue
+
+        if settings_key in upload_settings:
+            upload_settings = upload_settings[settings_key]
+        else:
+            upload_settings = {}
+        if "includeTags" not in upload_settings:
+            upload_settings["includeTags"] = []
+        if "excludeTags" not in upload_settings:
+            upload_settings["excludeTags"] = []
+        if "departmentMapping" not in upload_settings:
+            upload_settings["departmentMapping"] = []
+
+        with lib.telemetry.trace(business_id) as trace:
+            try:
+                return provider_upload(
+                    business_id,
+                    homepages[homepage_key],
+                    latitude,
+                    longitude,
+                    business_name,
+                    upload_settings,
+                    sinks,
+                    rebuild,
+                )
+            except Exception as e:
+                lib.sumologic.post("error", str(e), method, {"name": business_name})
+                raise
+            finally:
+                # One line per business sync, failed ones included
+                timings = {"name": business_name, **trace.summary()}
+                print(f"Sync timings: {json.dumps(timings)}")
+                lib.sumologic.post("info", "Sync timings", method, timings)
+
+    return None
@@ -0,0 +1,110 @@
+import os
+import signal
+import socket
+import threading
+import time
+import lib.httpclient
+import lib.jobs
+import lib.postgresql
+import lib.schedule
+import lib.schema
+import lib.sumologic
+import lib.upload
+
+"""
+RUNS THE QUEUED BUSINESS SYNCS
+
+Any number of worker processes can run next to the clock, each one
+syncing UPLOAD_WORKERS businesses at a time from lib.jobs' queue.
+"""
+
+# Businesses synced at once by this process, requests to a shared
+# upstream host are still throttled together by lib.ratelimit
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+
+# Seconds an idle thread waits before looking for a job again
+POLL_SECONDS = float(os.environ.get("WORKER_POLL_SECONDS", "10"))
+
+WORKER_ID = f"{os.environ.get('DYNO', socket.gethostname())}:{os.getpid()}"
+
+stopping = threading.Event()
+
+
+def run_job(job: dict):
+    records = lib.upload.get_businesses([job["business_id"]])
+    if len(records) == 0:
+        lib.jobs.complete(job, WORKER_ID)
+        return
+
+    print(f"Starting sync of business {job['business_id']}, attempt {job['attempts']}")
+    start = time.monotonic()
+    with lib.jobs.lease(job, WORKER_ID):
+        try:
+            stats = lib.upload.sync_business(records[0])
+        except Exception as e:
+            if lib.jobs.fail(job, WORKER_ID, str(e)):
+                lib.sumologic.post(
+                    "error",
+                    f"Gave up syncing after {job['attempts']} attempts: {e}",
+                    None,
+                    {"name": records[0]["name"]},
+                )
+            return
+
+    if not lib.jobs.complete(job, WORKER_ID):
+        print(f"Lost the job of business {job['business_id']} to another worker")
+    elif stats is not None:
+        lib.schedule.record_sync(job["business_id"], stats, time.monotonic() - start)
+
+
+def work():
+    while not stopping.is_set():
+        try:
+            job = lib.jobs.claim(WORKER_ID)
+        except Exception as e:
+            print(f"Failed to claim a job: {e}")
+            job = None
+
+        if job is None:
+            stopping.wait(POLL_SECONDS)
+            continue
+
+        # Its lease runs out if it couldn't be finished, and
+        # it's claimed again once the database is back
+        try:
+            run_job(job)
+        except Exception as e:
+            print(f"Failed to run the job of business {job['business_id']}: {e}")
+
+
+def report_stats():
+    for host, stats in lib.httpclient.get_stats().items():
+        print(
+            f"{host}: {stats['requests']} requests, {stats['errors']} failed, {stats['bytes'] / 1e6:.1f} MB, {stats['seconds'] / max(stats['requests'], 1):.2f}s average"
+        )
+
+    stats = lib.postgresql.get_stats()
+    print(
+        f"Postgres: {stats['checkouts']} checkouts, {stats['timeouts']} timed out, {stats['wait_seconds'] / max(stats['checkouts'], 1):.3f}s average and {stats['max_wait_seconds']:.2f}s longest wait, {stats['replaced']} broken connections replaced"
+    )
+
+    stats = lib.sumologic.shipper.get_stats()
+    print(
+        f"Sumo Logic: {stats['shipped']} events shipped, {stats['failed']} failed, {stats['dropped']} dropped"
+    )
+
+
+# Dynos get SIGTERM on restart. Running syncs carry on until the process
+# is killed, their jobs are picked up again once their lease runs out.
+signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+lib.schema.migrate()
+threads = [threading.Thread(target=work) for _ in range(UPLOAD_WORKERS)]
+for thread in threads:
+    thread.start()
+
+print(f"Worker {WORKER_ID} started with {UPLOAD_WORKERS} threads")
+while not stopping.wait(3600):
+    report_stats()
+for thread in threads:
+    thread.join()
@@ -3,6 +3,7 @@ import { camelCase, mapKeys } from "lodash";
 import AlgoliaSearch from "algoliasearch";
 
 import SumoLogic from "lib/api/sumologic";
+import { expandVariantImages } from "lib/api/common";
 import {
   ALGOLIASEARCH_APPLICATION_ID,
   ALGOLIASEARCH_API_KEY,
@@ -76,9 +77,9 @@ const algoliaClient: {
           // while objects on the front end use camel case.
           // We know the conversion is valid, so we ignore
           // typescript here
-          object = {
+          object = expandVariantImages({
             ...mapKeys(res, (v, k) => camelCase(k)),
-          };
+          });
         }
       })
       .catch((err) => {
@@ -99,9 +100,11 @@ const algoliaClient: {
         // while objects on the front end use camel case.
         // We know the conversion is valid, so we ignore
         // typescript here
-        objects = res.results.filter(Boolean).map((product) => ({
-          ...mapKeys(product, (v, k) => camelCase(k)),
-        }));
+        objects = res.results.filter(Boolean).map((product) =>
+          expandVariantImages({
+            ...mapKeys(product, (v, k) => camelCase(k)),
+          })
+        );
       })
       .catch((err) => {
         SumoLogic.log({
@@ -159,9 +162,11 @@ const algoliaClient: {
           // while objects on the front end use camel case.
           // We know the conversion is valid, so we ignore
           // typescript here
-          hits: res.hits.map((hit) => ({
-            ...mapKeys(hit, (v, k) => camelCase(k)),
-          })),
+          hits: res.hits.map((hit) =>
+            expandVariantImages({
+              ...mapKeys(hit, (v, k) => camelCase(k)),
+            })
+          ),
         };
       })
       .catch((err) => {
@@ -26,3 +26,39 @@ export const deepMapKeys = <T extends {} = never>(
   }
   return newObj;
 };
+
+/*
+  Algolia records store each distinct variant image
+  once in images, with variant_image_indices pointing
+  every variant at its image. Products everywhere
+  else keep one image per variant.
+*/
+export const compactVariantImages = (
+  variantImages: Array<string>
+): { images: Array<string>; variant_image_indices: Array<number> } => {
+  const images: Array<string> = [];
+  const indices = new Map<string, number>();
+  const variantImageIndices = variantImages.map((image) => {
+    let index = indices.get(image);
+    if (index === undefined) {
+      index = images.length;
+      indices.set(image, index);
+      images.push(image);
+    }
+    return index;
+  });
+  return { images, variant_image_indices: variantImageIndices };
+};
+
+export const expandVariantImages = <T extends Record<string, any>>(
+  product: T
+): T => {
+  const { images, variantImageIndices, ...rest } = product;
+  if (!Array.isArray(images) || !Array.isArray(variantImageIndices)) {
+    return product;
+  }
+  return {
+    ...rest,
+    variantImages: variantImageIndices.map((index: number) => images[index]),
+  } as unknown as T;
+};
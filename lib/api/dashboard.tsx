@@ -5,6 +5,7 @@ import Algolia from "lib/api/algolia";
 import Cloudinary from "lib/api/cloudinary";
 import Psql from "lib/api/postgresql";
 import SumoLogic from "lib/api/sumologic";
+import { compactVariantImages } from "lib/api/common";
 
 import type { BaseProduct, DatabaseProduct } from "../../common/Schema";
 
@@ -34,6 +35,22 @@ export function addHttpsProtocol(url: string): string {
   return url;
 }
 
+// Reserves count consecutive product ids for the business in a single
+// statement, so that uploads and syncs running at the same time never
+// share an id. Returns the first, or null if the update failed
+export async function reserveProductIds(
+  businessId: number,
+  count: number
+): Promise<number | null> {
+  const nextProductId = await Psql.increment({
+    table: "businesses",
+    key: "next_product_id",
+    amount: count,
+    conditions: SqlString.format("id=?", [businessId]),
+  });
+  return nextProductId === null ? null : nextProductId - count;
+}
+
 export async function productAdd(
   businessId: number,
   products: Array<DatabaseProduct>,
@@ -47,10 +64,9 @@ export async function productAdd(
     name: string;
     latitude: string;
     longitude: string;
-    next_product_id: number;
   }>({
     table: "businesses",
-    values: ["name", "latitude", "longitude", "next_product_id"],
+    values: ["name", "latitude", "longitude"],
     conditions: SqlString.format("id=?", [businessId]),
   });
   if (!businessResponse) {
@@ -82,20 +98,12 @@ export async function productAdd(
         variantImages,
         variantTags,
       }: DatabaseProduct) => {
-        // TODO: This only works if we are adding 1 item
-        // without a nextProductId. Should keep track of the
-        // nextProductId as items are uploaded instead of
-        // within the product
         if (!Number.isInteger(nextProductId)) {
-          nextProductId = businessResponse.rows[0].next_product_id;
-          const psqlErrorUpdateNextId = await Psql.update({
-            table: "businesses",
-            values: [{ key: "next_product_id", value: nextProductId + 1 }],
-            conditions: SqlString.format("id=?", [businessId]),
-          });
-          if (psqlErrorUpdateNextId) {
-            throw psqlErrorUpdateNextId;
+          const productId = await reserveProductIds(businessId, 1);
+          if (productId === null) {
+            throw Error("Failed to reserve a product id");
           }
+          nextProductId = productId;
         }
 
         if (addToCloudinary) {
@@ -148,7 +156,7 @@ export async function productAdd(
             price_range: priceRange,
             tags: tags.map((tag) => decode(tag)),
             tags_length: decode(tags.join("")).replace(/\s+/g, "").length,
-            variant_images: variantImages,
+            ...compactVariantImages(variantImages),
             variant_tags: variantTags.map((tag) => decode(tag)),
           },
           { autoGenerateObjectIDIfNotExist: false }
@@ -25,6 +25,7 @@ client.connect().catch((err) => {
 
 const psql: {
   delete: (params: Delete) => Promise<Error | null>;
+  increment: (params: Increment) => Promise<number | null>;
   insert: (params: Insert) => Promise<Error | null>;
   select: <T extends {} = never>(
     params: Select
@@ -48,6 +49,35 @@ const psql: {
 
     return error;
   },
+  increment: async (params) => {
+    const { amount, conditions, key, table } = params;
+    let response: number | null = null;
+
+    // Incremented in a single statement, so concurrent
+    // increments of the same row never see the same value
+    await client
+      .query(
+        SqlString.format(
+          `UPDATE ${table} SET ${key}=${key} + ? WHERE ${conditions} RETURNING ${key}`,
+          [amount]
+        )
+      )
+      .then((res: Pg.QueryResult) => {
+        if (res.rowCount !== 1) {
+          throw Error("Row does not exist");
+        }
+        response = res.rows[0][key];
+      })
+      .catch((err: Error) => {
+        SumoLogic.log({
+          level: "error",
+          message: `Failed to UPDATE from Heroku PSQL: ${err.message}`,
+          params,
+        });
+      });
+
+    return response;
+  },
   insert: async (params) => {
     const { table, values } = params;
     let error: Error | null = null;
@@ -202,6 +232,13 @@ export interface Delete {
   conditions: string;
 }
 
+export interface Increment {
+  table: Tables;
+  key: string;
+  amount: number;
+  conditions: string;
+}
+
 export interface Insert {
   table: Tables;
   values: NonEmptyArray<{ key: string; value: boolean | number | string }>;
@@ -7,6 +7,7 @@ import Psql from "lib/api/postgresql";
 import { addHttpsProtocol } from "lib/api/dashboard";
 import { runMiddlewareBusiness } from "lib/api/middleware";
 import SumoLogic from "lib/api/sumologic";
+import { compactVariantImages } from "lib/api/common";
 import { ProductUpdateSchema } from "common/ValidationSchema";
 
 import type {
@@ -109,7 +110,7 @@ export default async function handler(
       price_range: priceRange,
       tags: tags,
       tags_length: tags.join("").replace(/\s+/g, "").length,
-      variant_images: variantImages,
+      ...compactVariantImages(variantImages),
       variant_tags: variantTags,
     },
     { createIfNotExists: false }
@@ -5,7 +5,11 @@ import { decode, encode } from "html-entities";
 import { ETSY_API_KEY } from "lib/env";
 import Psql from "lib/api/postgresql";
 import SumoLogic from "lib/api/sumologic";
-import { productAdd, productDelete } from "lib/api/dashboard";
+import {
+  productAdd,
+  productDelete,
+  reserveProductIds,
+} from "lib/api/dashboard";
 import { runMiddlewareBusiness } from "lib/api/middleware";
 
 import type { NextApiResponse } from "next";
@@ -49,11 +53,10 @@ export default async function handler(
 
   const businessResponse = await Psql.select<{
     homepages: string;
-    next_product_id: number;
     upload_settings: string;
   }>({
     table: "businesses",
-    values: ["homepages", "next_product_id", "upload_settings"],
+    values: ["homepages", "upload_settings"],
     conditions: SqlString.format("id=?", [businessId]),
   });
   if (!businessResponse) {
@@ -76,7 +79,6 @@ export default async function handler(
     return;
   }
 
-  let nextProductId = businessResponse.rows[0].next_product_id;
   const homepages: Homepages = JSON.parse(businessResponse.rows[0].homepages);
   const uploadSettings: BaseUploadTypeSettings =
     JSON.parse(businessResponse.rows[0].upload_settings).etsy ?? {};
@@ -288,7 +290,6 @@ export default async function handler(
                   });
 
                 products.push({
-                  nextProductId: nextProductId + index,
                   name,
                   departments,
                   description,
@@ -304,7 +305,6 @@ export default async function handler(
               });
           }
 
-          nextProductId += data.results.length;
           page += 1;
 
           // Etsy API has a maximum of 2 requests per second
@@ -327,21 +327,21 @@ export default async function handler(
     return;
   }
 
-  const psqlErrorUpdateNextId = await Psql.update({
-    table: "businesses",
-    values: [{ key: "next_product_id", value: nextProductId }],
-    conditions: SqlString.format("id=?", [businessId]),
-  });
-  if (psqlErrorUpdateNextId) {
+  // Ids are reserved all at once, only after every product is fetched
+  const firstProductId = await reserveProductIds(businessId, products.length);
+  if (firstProductId === null) {
     SumoLogic.log({
       level: "error",
       method: "dashboard/upload/etsy",
-      message: "Failed to UPDATE Heroku PSQL",
-      params: { body: reqBody, error: psqlErrorUpdateNextId },
+      message: "Failed to UPDATE Heroku PSQL: Failed to reserve product ids",
+      params: { body: reqBody },
     });
     currentUploadsRunning.delete(businessId);
     return;
   }
+  products.forEach((product, index) => {
+    product.nextProductId = firstProductId + index;
+  });
 
   const deleteError = await productDelete(
     businessId,
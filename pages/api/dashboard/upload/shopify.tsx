@@ -5,7 +5,11 @@ import { decode, encode } from "html-entities";
 
 import Psql from "lib/api/postgresql";
 import SumoLogic from "lib/api/sumologic";
-import { productAdd, productDelete } from "lib/api/dashboard";
+import {
+  productAdd,
+  productDelete,
+  reserveProductIds,
+} from "lib/api/dashboard";
 import { runMiddlewareBusiness } from "lib/api/middleware";
 
 import type { NextApiResponse } from "next";
@@ -68,11 +72,10 @@ export default async function handler(
 
   const businessResponse = await Psql.select<{
     homepages: string;
-    next_product_id: number;
     upload_settings: string;
   }>({
     table: "businesses",
-    values: ["homepages", "next_product_id", "upload_settings"],
+    values: ["homepages", "upload_settings"],
     conditions: SqlString.format("id=?", [businessId]),
   });
   if (!businessResponse) {
@@ -95,7 +98,6 @@ export default async function handler(
     return;
   }
 
-  let nextProductId: number = businessResponse.rows[0].next_product_id;
   const homepages: Homepages = JSON.parse(businessResponse.rows[0].homepages);
   const uploadSettings: UploadTypeSettings =
     JSON.parse(businessResponse.rows[0].upload_settings).shopify ?? {};
@@ -238,7 +240,7 @@ export default async function handler(
             return;
           }
 
-          data.products.forEach((product: any, index: number) => {
+          data.products.forEach((product: any) => {
             let shouldInclude = true;
             let shouldExclude = false;
             if (includeTags.size > 0) {
@@ -320,7 +322,6 @@ export default async function handler(
             );
 
             products.push({
-              nextProductId: nextProductId + index,
               name,
               departments,
               description,
@@ -332,7 +333,6 @@ export default async function handler(
             });
           });
 
-          nextProductId += data.products.length;
           page += 1;
 
           // Cap Shopify API calls to 2 requests per second
@@ -355,21 +355,21 @@ export default async function handler(
     return;
   }
 
-  const psqlErrorUpdateNextId = await Psql.update({
-    table: "businesses",
-    values: [{ key: "next_product_id", value: nextProductId }],
-    conditions: SqlString.format("id=?", [businessId]),
-  });
-  if (psqlErrorUpdateNextId) {
+  // Ids are reserved all at once, only after every product is fetched
+  const firstProductId = await reserveProductIds(businessId, products.length);
+  if (firstProductId === null) {
     SumoLogic.log({
       level: "error",
       method: "dashboard/upload/shopify",
-      message: `Failed to UPDATE Heroku PSQL: ${psqlErrorUpdateNextId.message}`,
+      message: "Failed to UPDATE Heroku PSQL: Failed to reserve product ids",
       params: { body: reqBody },
     });
     currentUploadsRunning.delete(businessId);
     return;
   }
+  products.forEach((product, index) => {
+    product.nextProductId = firstProductId + index;
+  });
 
   const deleteError = await productDelete(
     businessId,
@@ -5,7 +5,11 @@ import Xss from "xss";
 
 import Psql from "lib/api/postgresql";
 import SumoLogic from "lib/api/sumologic";
-import { productAdd, productDelete } from "lib/api/dashboard";
+import {
+  productAdd,
+  productDelete,
+  reserveProductIds,
+} from "lib/api/dashboard";
 import { runMiddlewareBusiness } from "lib/api/middleware";
 import { UploadSquareProductsSchema } from "common/ValidationSchema";
 
@@ -101,11 +105,10 @@ export default async function handler(
 
   const businessResponse = await Psql.select<{
     homepages: string;
-    next_product_id: number;
     upload_settings: string;
   }>({
     table: "businesses",
-    values: ["homepages", "next_product_id", "upload_settings"],
+    values: ["homepages", "upload_settings"],
     conditions: SqlString.format("id=?", [businessId]),
   });
   if (!businessResponse) {
@@ -128,7 +131,6 @@ export default async function handler(
     return;
   }
 
-  let nextProductId: number = businessResponse.rows[0].next_product_id;
   const homepages: Homepages = JSON.parse(businessResponse.rows[0].homepages);
   const uploadSettings: UploadTypeSettings =
     JSON.parse(businessResponse.rows[0].upload_settings).square ?? {};
@@ -352,7 +354,6 @@ export default async function handler(
       }
 
       products.push({
-        nextProductId,
         name,
         departments,
         description,
@@ -362,8 +363,6 @@ export default async function handler(
         variantImages,
         variantTags,
       });
-
-      nextProductId += 1;
     } else if (visible) {
       const variantTag = optionValue.join(" ");
       if (variantTag.length > 0) {
@@ -376,21 +375,21 @@ export default async function handler(
     }
   });
 
-  const psqlErrorUpdateNextId = await Psql.update({
-    table: "businesses",
-    values: [{ key: "next_product_id", value: nextProductId }],
-    conditions: SqlString.format("id=?", [businessId]),
-  });
-  if (psqlErrorUpdateNextId) {
+  // Ids are reserved all at once, only after every product is fetched
+  const firstProductId = await reserveProductIds(businessId, products.length);
+  if (firstProductId === null) {
     SumoLogic.log({
       level: "error",
       method: "dashboard/upload/square",
-      message: `Failed to UPDATE Heroku PSQL: ${psqlErrorUpdateNextId.message}`,
+      message: "Failed to UPDATE Heroku PSQL: Failed to reserve product ids",
       params: { body: reqBody },
     });
     currentUploadsRunning.delete(businessId);
     return;
   }
+  products.forEach((product, index) => {
+    product.nextProductId = firstProductId + index;
+  });
 
   const deleteError = await productDelete(
     businessId,
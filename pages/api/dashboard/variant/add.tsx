@@ -4,6 +4,7 @@ import Algolia from "lib/api/algolia";
 import Cloudinary from "lib/api/cloudinary";
 import SumoLogic from "lib/api/sumologic";
 import { runMiddlewareBusiness } from "lib/api/middleware";
+import { compactVariantImages } from "lib/api/common";
 import { VariantAddSchema } from "common/ValidationSchema";
 
 import type { VariantAddRequest, VariantAddResponse } from "common/Schema";
@@ -91,7 +92,7 @@ export default async function handler(
   const uploadObjectError = await Algolia.partialUpdateObject(
     {
       objectID: `${businessId}_${productId}`,
-      variant_images: object.variantImages,
+      ...compactVariantImages(object.variantImages),
       variant_tags: object.variantTags,
     },
     { createIfNotExists: false }
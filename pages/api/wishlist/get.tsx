@@ -54,6 +54,8 @@ export default async function handler(
   const attributesToRetrieve = [
     "objectId",
     "business",
+    "images",
+    "variant_image_indices",
     "variant_images",
     "link",
     "name",
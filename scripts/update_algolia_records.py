@@ -1,70 +1,243 @@
+import argparse
+import collections
+import copy
+import html
+import importlib
+import json
 import os
 import pprint
-import re
-import html
+from algoliasearch.http.hosts import CallType
+from algoliasearch.http.verb import Verb
 from algoliasearch.search_client import SearchClient
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+APPLIES A TRANSFORM TO EVERY RECORD OF THE ALGOLIA INDEX
+
+Records are browsed one page at a time and only the ones the transform
+changed are written back, in batches spread over several writers, so
+memory use stays flat however large the index is. With --checkpoint, the
+browse cursor of the last page fully written is saved, and running again
+with the same file resumes after it.
+
+Transforms take a record and return it changed, they are either defined
+below or given as module:function. A resumed run may browse again pages
+that were written after the checkpoint, so transforms must leave records
+they already changed as they are.
+"""
 
 # Pretty Print
 pp = pprint.PrettyPrinter(indent=4)
 
-# Get environment variables
-ALGOLIASEARCH_API_KEY = os.getenv('ALGOLIASEARCH_API_KEY')
-ALGOLIASEARCH_APPLICATION_ID = os.getenv('ALGOLIASEARCH_APPLICATION_ID')
-ALGOLIASEARCH_INDEX = os.environ.get('ALGOLIASEARCH_INDEX')
-
-# Check all environment variables are set correctly
-if not ALGOLIASEARCH_API_KEY:
-    print("ALGOLIASEARCH_API_KEY not set")
-    exit(-1)
-
-if not ALGOLIASEARCH_APPLICATION_ID:
-    print("ALGOLIASEARCH_APPLICATION_ID not set")
-    exit(-1)
-
-if not ALGOLIASEARCH_INDEX:
-    print("ALGOLIASEARCH_INDEX not set")
-    exit(-1)
-
-print("ALGOLIASEARCH_API_KEY={}".format(ALGOLIASEARCH_API_KEY))
-print("ALGOLIASEARCH_APPLICATION_ID={}".format(ALGOLIASEARCH_APPLICATION_ID))
-print("ALGOLIASEARCH_INDEX={}".format(ALGOLIASEARCH_INDEX))
-
-# Connecting to index
-print("Connecting to Algolia index...")
-client = SearchClient.create(ALGOLIASEARCH_APPLICATION_ID, ALGOLIASEARCH_API_KEY)
-index = client.init_index('dummy')#ALGOLIASEARCH_INDEX)
-print("Connected to Algolia index")
-
-# Make sure the index exists
-if not index.exists():
-    print("Index does not exist!")
-    exit(-1)
-	
-# Empty query will match all records
-print("Fetching documents...")
-query = '' 
-res = index.browse_objects({'query': query})
-print("Documents fetched!")
-
-print("Updating documents...")
-hits = []
-for hit in res:
-    # Edit hit here
-
-    ### ADD CODE HERE ###
+
+def unescape_text(hit):
     hit["name"] = html.unescape(hit["name"])
     hit["business"] = html.unescape(hit["business"])
     hit["description"] = html.unescape(hit["description"])
     hit["departments"] = list(map(html.unescape, hit["departments"]))
     hit["tags"] = list(map(html.unescape, hit["tags"]))
     hit["variant_tags"] = list(map(html.unescape, hit["variant_tags"]))
-    ### END CODE HERE ###
+    return hit
+
+
+TRANSFORMS = {
+    "unescape_text": unescape_text,
+}
+
+
+def get_transform(name):
+    if name in TRANSFORMS:
+        return TRANSFORMS[name]
+    module, function = name.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def browse(client, index_name, cursor=None):
+    """Yields each page of records along with the cursor to browse on from"""
+    while True:
+        data = {"cursor": cursor} if cursor else {"query": ""}
+        res = client.custom_request(
+            data, f"1/indexes/{index_name}/browse", Verb.POST, CallType.READ
+        )
+        cursor = res.get("cursor")
+        yield res["hits"], cursor
+        if not cursor:
+            return
+
+
+def get_changes(hit, new_hit):
+    """
+    Returns the changed attributes of the record, or None when the
+    transform removed attributes, which only saving the whole record can do
+    """
+    if any(k not in new_hit for k in hit):
+        return None
+    changes = {k: v for k, v in new_hit.items() if hit.get(k) != v}
+    if len(changes) > 0:
+        changes["objectID"] = hit["objectID"]
+    return changes
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, checkpoint):
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def write(index, updates, saves):
+    if len(updates) > 0:
+        index.partial_update_objects(updates).wait()
+    if len(saves) > 0:
+        index.save_objects(saves).wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Applies a transform to every record of the Algolia index"
+    )
+    parser.add_argument(
+        "--transform",
+        default="unescape_text",
+        help=f"one of {', '.join(TRANSFORMS)}, or module:function",
+    )
+    parser.add_argument("--index", default=os.environ.get("ALGOLIASEARCH_INDEX"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument(
+        "--checkpoint", help="JSON file to save progress to and resume from"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="count the records and attributes the transform changes, without writing",
+    )
+    parser.add_argument(
+        "--show", type=int, default=3, help="with --dry-run, changes to print"
+    )
+    args = parser.parse_args()
+
+    # Check all environment variables are set correctly
+    ALGOLIASEARCH_API_KEY = os.getenv("ALGOLIASEARCH_API_KEY")
+    ALGOLIASEARCH_APPLICATION_ID = os.getenv("ALGOLIASEARCH_APPLICATION_ID")
+    if not ALGOLIASEARCH_API_KEY:
+        print("ALGOLIASEARCH_API_KEY not set")
+        exit(-1)
+
+    if not ALGOLIASEARCH_APPLICATION_ID:
+        print("ALGOLIASEARCH_APPLICATION_ID not set")
+        exit(-1)
+
+    if not args.index:
+        print("ALGOLIASEARCH_INDEX not set")
+        exit(-1)
+
+    transform = get_transform(args.transform)
+
+    # Connecting to index
+    print(f"Connecting to Algolia index {args.index}...")
+    client = SearchClient.create(ALGOLIASEARCH_APPLICATION_ID, ALGOLIASEARCH_API_KEY)
+    index = client.init_index(args.index)
+
+    # Make sure the index exists
+    if not index.exists():
+        print("Index does not exist!")
+        exit(-1)
+
+    checkpoint = read_checkpoint(args.checkpoint) or {
+        "index": args.index,
+        "cursor": None,
+        "browsed": 0,
+        "changed": 0,
+    }
+    if checkpoint["index"] != args.index:
+        print(f"Checkpoint is of index {checkpoint['index']}!")
+        exit(-1)
+    if checkpoint["cursor"]:
+        print(f"Resuming after {checkpoint['browsed']} records...")
+
+    browsed = checkpoint["browsed"]
+    changed = checkpoint["changed"]
+    attributes = collections.Counter()
+    shown = 0
+
+    # Pages whose writes are still running, oldest first. The checkpoint
+    # only moves past a page once it and every page before it are written.
+    pending = collections.deque()
+
+    def finish_oldest():
+        page, futures = pending.popleft()
+        for future in futures:
+            future.result()
+        checkpoint.update(page)
+        if args.checkpoint:
+            write_checkpoint(args.checkpoint, checkpoint)
+
+    print("Updating records...")
+    with ThreadPoolExecutor(args.writers) as executor:
+        for hits, cursor in browse(client, args.index, checkpoint["cursor"]):
+            updates = []
+            saves = []
+            for hit in hits:
+                new_hit = transform(copy.deepcopy(hit))
+                changes = get_changes(hit, new_hit)
+                if changes is None:
+                    saves.append(new_hit)
+                    keys = {*hit, *new_hit}
+                elif len(changes) > 0:
+                    updates.append(changes)
+                    keys = changes
+                else:
+                    continue
+
+                keys = [k for k in keys if hit.get(k) != new_hit.get(k)]
+                attributes.update(keys)
+                if args.dry_run and shown < args.show:
+                    pp.pprint({k: (hit.get(k), new_hit.get(k)) for k in keys})
+                    shown += 1
+
+            browsed += len(hits)
+            changed += len(updates) + len(saves)
+            if args.dry_run:
+                continue
+
+            futures = [
+                executor.submit(
+                    write,
+                    index,
+                    updates[i : i + args.batch_size],
+                    saves[i : i + args.batch_size],
+                )
+                for i in range(0, max(len(updates), len(saves)), args.batch_size)
+            ]
+            pending.append(
+                ({"cursor": cursor, "browsed": browsed, "changed": changed}, futures)
+            )
+
+            # Browsing stays at most a couple of pages per writer ahead
+            while len(pending) > 0 and (
+                len(pending) > 2 * args.writers or all(x.done() for x in pending[0][1])
+            ):
+                finish_oldest()
+            print(f"Browsed {browsed} records, {changed} changed")
+
+        while len(pending) > 0:
+            finish_oldest()
+
+    print(
+        f"{'Would change' if args.dry_run else 'Changed'} {changed} of {browsed} records"
+    )
+    for attribute, count in attributes.most_common():
+        print(f"  {attribute}: {count}")
+    if args.checkpoint and not args.dry_run:
+        os.remove(args.checkpoint)
 
-    hits.append(hit)
-print("Documents updated!")
 
-# Update hits in index
-print("Updating index...")
-for i in range(0, len(hits), 100):
-    index.save_objects(hits[i:i+100])
-print("Updated index!")
+if __name__ == "__main__":
+    main()
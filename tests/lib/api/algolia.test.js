@@ -0,0 +1,128 @@
+/**
+ * Algolia Client Unit Tests
+ *
+ * @group unit
+ * @group website
+ * @group algolia
+ */
+
+const imageUrls = [
+  "https://res.cloudinary.com/locality/image/upload/1.webp",
+  "https://res.cloudinary.com/locality/image/upload/2.webp",
+];
+
+// Record stored with each variant image once
+const compactRecord = {
+  objectID: "1_2",
+  name: "Mug",
+  images: [imageUrls[0], imageUrls[1]],
+  variant_image_indices: [0, 0, 1],
+  variant_tags: ["Red", "Blue", "Green"],
+};
+
+// Record written before variant images were stored once
+const legacyRecord = {
+  objectID: "1_3",
+  name: "Cup",
+  variant_images: [imageUrls[1], imageUrls[1]],
+  variant_tags: ["Red", "Blue"],
+};
+
+const log = jest.fn();
+describe("Algolia", () => {
+  let index;
+
+  beforeAll(() => {
+    jest.doMock("lib/api/sumologic", () => ({
+      log,
+    }));
+  });
+
+  beforeEach(() => {
+    jest.resetModules();
+    index = {
+      getObject: jest.fn(),
+      getObjects: jest.fn(),
+      search: jest.fn(),
+    };
+    jest.doMock("algoliasearch", () => () => ({
+      initIndex: () => index,
+    }));
+  });
+
+  afterEach(() => {
+    jest.clearAllMocks();
+  });
+
+  it("Get object, compact record, variant images expanded", async () => {
+    // Arrange
+    index.getObject.mockImplementation(async () => compactRecord);
+    const algolia = require("lib/api/algolia").default;
+
+    // Act
+    const actual = await algolia.getObject("1_2");
+
+    // Assert
+    expect(actual).toEqual({
+      objectId: "1_2",
+      name: "Mug",
+      variantImages: [imageUrls[0], imageUrls[0], imageUrls[1]],
+      variantTags: ["Red", "Blue", "Green"],
+    });
+  });
+
+  it("Get object, legacy record, variant images kept", async () => {
+    // Arrange
+    index.getObject.mockImplementation(async () => legacyRecord);
+    const algolia = require("lib/api/algolia").default;
+
+    // Act
+    const actual = await algolia.getObject("1_3");
+
+    // Assert
+    expect(actual).toEqual({
+      objectId: "1_3",
+      name: "Cup",
+      variantImages: [imageUrls[1], imageUrls[1]],
+      variantTags: ["Red", "Blue"],
+    });
+  });
+
+  it("Get objects, compact and legacy records, variant images expanded", async () => {
+    // Arrange
+    index.getObjects.mockImplementation(async () => ({
+      results: [compactRecord, null, legacyRecord],
+    }));
+    const algolia = require("lib/api/algolia").default;
+
+    // Act
+    const actual = await algolia.getObjects(["1_2", "1_4", "1_3"]);
+
+    // Assert
+    expect(actual.map((x) => x.variantImages)).toEqual([
+      [imageUrls[0], imageUrls[0], imageUrls[1]],
+      [imageUrls[1], imageUrls[1]],
+    ]);
+  });
+
+  it("Search, compact and legacy hits, variant images expanded", async () => {
+    // Arrange
+    index.search.mockImplementation(async () => ({
+      hits: [compactRecord, legacyRecord],
+      nbHits: 2,
+    }));
+    const algolia = require("lib/api/algolia").default;
+
+    // Act
+    const actual = await algolia.search("mug");
+
+    // Assert
+    expect(actual.nbHits).toBe(2);
+    expect(actual.hits.map((x) => x.variantImages)).toEqual([
+      [imageUrls[0], imageUrls[0], imageUrls[1]],
+      [imageUrls[1], imageUrls[1]],
+    ]);
+    expect(actual.hits[0]).not.toHaveProperty("images");
+    expect(actual.hits[0]).not.toHaveProperty("variantImageIndices");
+  });
+});
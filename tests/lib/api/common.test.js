@@ -0,0 +1,111 @@
+/**
+ * API Common Unit Tests
+ *
+ * @group unit
+ * @group website
+ * @group common
+ */
+
+const {
+  compactVariantImages,
+  expandVariantImages,
+} = require("lib/api/common");
+
+const imageUrls = [
+  "https://res.cloudinary.com/locality/image/upload/1.webp",
+  "https://res.cloudinary.com/locality/image/upload/2.webp",
+  "https://res.cloudinary.com/locality/image/upload/3.webp",
+];
+
+describe("Common", () => {
+  it("Compact variant images, shared images, stored once", () => {
+    // Act
+    const actual = compactVariantImages([
+      imageUrls[0],
+      imageUrls[1],
+      imageUrls[0],
+      imageUrls[2],
+      imageUrls[1],
+    ]);
+
+    // Assert
+    expect(actual).toEqual({
+      images: [imageUrls[0], imageUrls[1], imageUrls[2]],
+      variant_image_indices: [0, 1, 0, 2, 1],
+    });
+  });
+
+  it("Compact variant images, no variants, empty arrays", () => {
+    // Act
+    const actual = compactVariantImages([]);
+
+    // Assert
+    expect(actual).toEqual({ images: [], variant_image_indices: [] });
+  });
+
+  it("Expand variant images, compact product, one image per variant", () => {
+    // Arrange
+    const product = {
+      name: "Mug",
+      images: [imageUrls[0], imageUrls[1]],
+      variantImageIndices: [1, 0, 1],
+      variantTags: ["Red", "Blue", "Green"],
+    };
+
+    // Act
+    const actual = expandVariantImages(product);
+
+    // Assert
+    expect(actual).toEqual({
+      name: "Mug",
+      variantImages: [imageUrls[1], imageUrls[0], imageUrls[1]],
+      variantTags: ["Red", "Blue", "Green"],
+    });
+  });
+
+  it("Expand variant images, compacted then expanded, same variant images", () => {
+    // Arrange
+    const variantImages = [imageUrls[2], imageUrls[2], imageUrls[0]];
+    const { images, variant_image_indices } =
+      compactVariantImages(variantImages);
+
+    // Act
+    const actual = expandVariantImages({
+      images,
+      variantImageIndices: variant_image_indices,
+    });
+
+    // Assert
+    expect(actual).toEqual({ variantImages });
+  });
+
+  it("Expand variant images, legacy product, passed through", () => {
+    // Arrange
+    const product = {
+      name: "Mug",
+      variantImages: [imageUrls[0], imageUrls[0]],
+      variantTags: ["Red", "Blue"],
+    };
+
+    // Act
+    const actual = expandVariantImages(product);
+
+    // Assert
+    expect(actual).toBe(product);
+  });
+
+  it("Expand variant images, images without indices, passed through", () => {
+    // Arrange
+    const product = {
+      name: "Mug",
+      images: [imageUrls[0]],
+      variantImages: [imageUrls[0]],
+    };
+
+    // Act
+    const actual = expandVariantImages(product);
+
+    // Assert
+    expect(actual).toBe(product);
+  });
+});
@@ -18,6 +18,14 @@ const imageFiles = [
   fs.readFileSync("tests/pages/api/dashboard/variant/image2.b64").toString(),
   fs.readFileSync("tests/pages/api/dashboard/variant/image3.b64").toString(),
 ];
+// Cloudinary urls of the variant images, the
+// first of which is shared by two variants
+const imageUrls = [
+  "https://res.cloudinary.com/locality/image/upload/1.webp",
+  "https://res.cloudinary.com/locality/image/upload/2.webp",
+  "https://res.cloudinary.com/locality/image/upload/3.webp",
+];
+
 const userId = faker.datatype.number();
 const log = jest.fn();
 const runMiddlewareBusiness = jest.fn().mockImplementation(async (req) => {
@@ -188,15 +196,13 @@ describe("Add variant", () => {
 
   it("Database error (updating product), valid inputs, logged once + server error response", async () => {
     // Arrange
-    const url = faker.internet.url();
+    const url = imageUrls[2];
     const productId = faker.datatype.number();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
+    const numVariants = 3;
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = faker.random.words();
     const newVariantImage =
       imageFiles[faker.datatype.number({ min: 0, max: 2 })];
@@ -241,7 +247,8 @@ describe("Add variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [...variantImages, url],
+        images: [imageUrls[0], imageUrls[1], imageUrls[2]],
+        variant_image_indices: [0, 1, 0, 2],
         variant_tags: [...variantTags, newVariantTag],
       });
       return new Error("Failed to update object");
@@ -292,15 +299,13 @@ describe("Add variant", () => {
 
   it("Health check, valid inputs, valid response", async () => {
     // Arrange
-    const url = faker.internet.url();
+    const url = imageUrls[2];
     const productId = faker.datatype.number();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
+    const numVariants = 3;
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = faker.random.words();
     const newVariantImage =
       imageFiles[faker.datatype.number({ min: 0, max: 2 })];
@@ -345,7 +350,8 @@ describe("Add variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [...variantImages, url],
+        images: [imageUrls[0], imageUrls[1], imageUrls[2]],
+        variant_image_indices: [0, 1, 0, 2],
         variant_tags: [...variantTags, newVariantTag],
       });
       return null;
@@ -400,15 +406,13 @@ describe("Add variant", () => {
 
   it("Ignore request id from non-admins, invalid inputs, valid response", async () => {
     // Arrange
-    const url = faker.internet.url();
+    const url = imageUrls[2];
     const productId = faker.datatype.number();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
+    const numVariants = 3;
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = faker.random.words();
     const newVariantImage =
       imageFiles[faker.datatype.number({ min: 0, max: 2 })];
@@ -453,7 +457,8 @@ describe("Add variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [...variantImages, url],
+        images: [imageUrls[0], imageUrls[1], imageUrls[2]],
+        variant_image_indices: [0, 1, 0, 2],
         variant_tags: [...variantTags, newVariantTag],
       });
       return null;
@@ -725,15 +730,13 @@ describe("Add variant", () => {
 
   it("XSS attack, valid inputs, valid response", async () => {
     // Arrange
-    const url = faker.internet.url();
+    const url = imageUrls[2];
     const productId = faker.datatype.number();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
+    const numVariants = 3;
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = `<script>window.onload = function() {var link=document.getElementsByTagName("a");link[0].href="${faker.internet.url()}";}</script>`;
     const newVariantImage = `<script src=”${faker.internet.url()}”/>`;
     const description = faker.commerce.productDescription();
@@ -777,7 +780,8 @@ describe("Add variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [...variantImages, url],
+        images: [imageUrls[0], imageUrls[1], imageUrls[2]],
+        variant_image_indices: [0, 1, 0, 2],
         variant_tags: [...variantTags, xss(newVariantTag)],
       });
       return null;
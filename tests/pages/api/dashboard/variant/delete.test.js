@@ -11,6 +11,14 @@
 const faker = require("faker");
 const xss = require("xss");
 
+// Cloudinary urls of the variant images, the
+// first of which is shared by two variants
+const imageUrls = [
+  "https://res.cloudinary.com/locality/image/upload/1.webp",
+  "https://res.cloudinary.com/locality/image/upload/2.webp",
+  "https://res.cloudinary.com/locality/image/upload/3.webp",
+];
+
 const userId = faker.datatype.number();
 const log = jest.fn();
 const runMiddlewareBusiness = jest.fn().mockImplementation(async (req) => {
@@ -86,18 +94,13 @@ describe("Update variant", () => {
 
   it("Database error (updating product), valid inputs, logged once + server error response", async () => {
     // Arrange
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const numVariants = 3;
+    const variantIndex = 1;
     const productId = faker.datatype.number();
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const description = faker.commerce.productDescription();
     const tags = Array.from(
       {
@@ -139,10 +142,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0]],
+        variant_image_indices: [0, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           ...variantTags.slice(variantIndex + 1),
@@ -189,18 +190,13 @@ describe("Update variant", () => {
 
   it("Database error (deleting variant), valid inputs, valid response", async () => {
     // Arrange
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const numVariants = 3;
+    const variantIndex = 1;
     const productId = faker.datatype.number();
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const description = faker.commerce.productDescription();
     const tags = Array.from(
       {
@@ -242,10 +238,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0]],
+        variant_image_indices: [0, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           ...variantTags.slice(variantIndex + 1),
@@ -296,18 +290,13 @@ describe("Update variant", () => {
 
   it("Health check, valid inputs, valid response", async () => {
     // Arrange
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const numVariants = 3;
+    const variantIndex = 1;
     const productId = faker.datatype.number();
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const description = faker.commerce.productDescription();
     const tags = Array.from(
       {
@@ -349,10 +338,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0]],
+        variant_image_indices: [0, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           ...variantTags.slice(variantIndex + 1),
@@ -579,18 +566,13 @@ describe("Update variant", () => {
 
   it("Ignore request id from non-admins, valid inputs, valid response", async () => {
     // Arrange
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const numVariants = 3;
+    const variantIndex = 1;
     const productId = faker.datatype.number();
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const description = faker.commerce.productDescription();
     const tags = Array.from(
       {
@@ -632,10 +614,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0]],
+        variant_image_indices: [0, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           ...variantTags.slice(variantIndex + 1),
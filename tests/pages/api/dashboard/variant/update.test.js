@@ -18,6 +18,14 @@ const imageFiles = [
   fs.readFileSync("tests/pages/api/dashboard/variant/image2.b64").toString(),
   fs.readFileSync("tests/pages/api/dashboard/variant/image3.b64").toString(),
 ];
+// Cloudinary urls of the variant images, the
+// first of which is shared by two variants
+const imageUrls = [
+  "https://res.cloudinary.com/locality/image/upload/1.webp",
+  "https://res.cloudinary.com/locality/image/upload/2.webp",
+  "https://res.cloudinary.com/locality/image/upload/3.webp",
+];
+
 const userId = faker.datatype.number();
 const log = jest.fn();
 const runMiddlewareBusiness = jest.fn().mockImplementation(async (req) => {
@@ -198,19 +206,14 @@ describe("Update variant", () => {
 
   it("Database error (updating product), valid inputs, logged once + server error response", async () => {
     // Arrange
-    const url = faker.internet.url();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const url = imageUrls[2];
+    const numVariants = 3;
+    const variantIndex = 1;
     const productId = faker.datatype.number();
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = faker.random.words();
     const newVariantImage =
       imageFiles[faker.datatype.number({ min: 0, max: 2 })];
@@ -255,11 +258,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          url,
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0], imageUrls[2]],
+        variant_image_indices: [0, 1, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           newVariantTag,
@@ -318,19 +318,14 @@ describe("Update variant", () => {
 
   it("Health check, valid inputs, valid response", async () => {
     // Arrange
-    const url = faker.internet.url();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const url = imageUrls[2];
+    const numVariants = 3;
+    const variantIndex = 1;
     const productId = faker.datatype.number();
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = faker.random.words();
     const newVariantImage =
       imageFiles[faker.datatype.number({ min: 0, max: 2 })];
@@ -375,11 +370,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          url,
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0], imageUrls[2]],
+        variant_image_indices: [0, 1, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           newVariantTag,
@@ -579,19 +571,14 @@ describe("Update variant", () => {
 
   it("Ignore request id from non-admins, invalid inputs, valid response", async () => {
     // Arrange
-    const url = faker.internet.url();
+    const url = imageUrls[2];
     const productId = faker.datatype.number();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const numVariants = 3;
+    const variantIndex = 1;
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = faker.random.words();
     const newVariantImage =
       imageFiles[faker.datatype.number({ min: 0, max: 2 })];
@@ -636,11 +623,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          url,
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0], imageUrls[2]],
+        variant_image_indices: [0, 1, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           newVariantTag,
@@ -1021,19 +1005,14 @@ describe("Update variant", () => {
 
   it("XSS attack, valid inputs, valid response", async () => {
     // Arrange
-    const url = faker.internet.url();
+    const url = imageUrls[2];
     const productId = faker.datatype.number();
-    const numVariants = faker.datatype.number({ min: 1, max: 5 });
-    const variantIndex = faker.datatype.number({
-      min: 0,
-      max: numVariants - 1,
-    });
+    const numVariants = 3;
+    const variantIndex = 1;
     const variantTags = Array.from({ length: numVariants }, () =>
       faker.random.words()
     );
-    const variantImages = Array.from({ length: numVariants }, () =>
-      faker.internet.url()
-    );
+    const variantImages = [imageUrls[0], imageUrls[1], imageUrls[0]];
     const newVariantTag = `<script>window.onload = function() {var link=document.getElementsByTagName("a");link[0].href="${faker.internet.url()}";}</script>`;
     const newVariantImage = `<script src=”${faker.internet.url()}”/>`;
     const description = faker.commerce.productDescription();
@@ -1077,11 +1056,8 @@ describe("Update variant", () => {
     const partialUpdateObject = jest.fn().mockImplementation(async (params) => {
       expect(params).toEqual({
         objectID: `${userId}_${productId}`,
-        variant_images: [
-          ...variantImages.slice(0, variantIndex),
-          url,
-          ...variantImages.slice(variantIndex + 1),
-        ],
+        images: [imageUrls[0], imageUrls[2]],
+        variant_image_indices: [0, 1, 0],
         variant_tags: [
           ...variantTags.slice(0, variantIndex),
           xss(newVariantTag),